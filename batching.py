@@ -0,0 +1,93 @@
+"""
+Micro-batching for concurrent model calls
+
+Concurrent requests submit single items (a query to embed, a query/document
+pair to rerank). A background thread collects them for up to max_wait_ms or
+until max_batch_size items are waiting, runs one batched model call and hands
+each caller its own result. Under load this turns many single-item calls into
+a few batched ones; a lone request waits at most max_wait_ms extra.
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, List
+
+
+class MicroBatcher:
+    """Run single-item requests from many threads as batched calls"""
+
+    def __init__(self, fn: Callable[[List[Any]], List[Any]], max_batch_size: int = 32, max_wait_ms: float = 5,
+                 name: str = "micro-batcher"):
+        """
+        Args:
+            fn: Batched function mapping a list of items to a list of results in the same order
+            max_batch_size: Maximum items per call of fn
+            max_wait_ms: Maximum time to wait for more items after the first one arrives
+            name: Name of the worker thread
+        """
+        self.fn = fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.name = name
+        self.batches = 0
+        self.items = 0
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+
+    def submit(self, item: Any) -> Future:
+        """Queue an item; the returned future resolves to its result"""
+        if self._thread is None:
+            self._start()
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def __call__(self, item: Any) -> Any:
+        """Submit an item and wait for its result"""
+        return self.submit(item).result()
+
+    def map(self, items: List[Any]) -> List[Any]:
+        """Submit several items and wait for all results (they may share batches with other callers)"""
+        futures = [self.submit(item) for item in items]
+        return [future.result() for future in futures]
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+
+            items = [item for item, _ in batch]
+            try:
+                results = self.fn(items)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+            self.batches += 1
+            self.items += len(batch)
+
+    def stats(self) -> dict:
+        """Return the number of batches run and the mean batch size"""
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "mean_batch_size": self.items / self.batches if self.batches else 0.0
+        }
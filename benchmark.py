@@ -0,0 +1,226 @@
+"""
+Benchmark the TinyRAG pipeline and each of its stages
+
+Builds a synthetic corpus of --docs documents, then times:
+
+- embed: get_embedding of a query (cache disabled)
+- insert: Database.insert_many, per batch of --batch-size documents
+- query: vector KNN through the --vector-store (sqlite-vec table or NumPy matrix)
+- rerank: get_reranker on the k retrieved documents
+- llm: get_llm_stream (time to first token and full answer)
+- pipeline: search-style answer: embed, retrieve, rerank, pack the prompt, stream the answer
+
+With --models stub (default) the models are deterministic stand-ins
+(stub_models.py), so the database, caches and glue code are measured alone;
+with --models real the configured models are loaded. Corpus vectors are
+random unit vectors written directly to the database, so --docs can go to a
+million without embedding every document.
+
+Results (p50/p95/p99 latency, throughput, peak RSS per stage) are printed and
+written as JSON with --output; --compare prints the change against an earlier
+results file.
+
+Usage:
+    python benchmark.py --docs 100000 --queries 200 --output bench.json
+    python benchmark.py --docs 100000 --compare bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import tempfile
+import time
+
+import numpy as np
+
+import models
+from config import IngestConfig
+
+WORDS = ("law court contract tax land property worker employer company share police criminal civil marriage "
+         "child heir will debt loan bank insurance patent copyright trade import export license permit fine "
+         "penalty appeal judge witness evidence damage lease rent sale purchase partner capital dividend").split()
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process so far (ru_maxrss is KiB on Linux, bytes on macOS)"""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 2**20 if platform.system() == "Darwin" else rss / 2**10
+
+
+def summarize(latencies, items: int = None) -> dict:
+    """Latency percentiles (ms) and throughput of a stage; items is the number of items processed if not one per call"""
+    latencies = np.asarray(latencies)
+    total = latencies.sum()
+    return {
+        "calls": len(latencies),
+        "p50_ms": float(np.percentile(latencies, 50) * 1000),
+        "p95_ms": float(np.percentile(latencies, 95) * 1000),
+        "p99_ms": float(np.percentile(latencies, 99) * 1000),
+        "mean_ms": float(latencies.mean() * 1000),
+        "throughput_per_s": float((items or len(latencies)) / total) if total > 0 else 0.0,
+        "peak_rss_mb": round(peak_rss_mb(), 1)
+    }
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def synthetic_texts(rng, count: int, words: int):
+    return [" ".join(rng.choice(WORDS, size=words)) for _ in range(count)]
+
+
+def run(args) -> dict:
+    # Set before the model modules read their configuration
+    os.environ["QUERY_CACHE_SIZE"] = "0" # every query is embedded
+    os.environ["RERANK_CACHE_SIZE"] = "0" # every pair is scored
+    if args.models == "stub":
+        import stub_models
+        stub_models.install(embedding_dim=args.dim, answer_tokens=args.answer_tokens, token_delay_ms=args.token_delay_ms)
+        dim = args.dim
+    else:
+        from embedding import get_embedding_dimension
+        dim = get_embedding_dimension()
+
+    from database import Database
+    from embedding import get_embedding
+    from llm import get_llm_stream
+    from prompt import build_rag_prompt
+    from reranker import get_reranker
+    from retrieval import embed_query, retrieve
+    from vector_store import get_vector_store
+
+    rng = np.random.default_rng(args.seed)
+    queries = synthetic_texts(rng, args.queries, 8)
+    stages = {}
+
+    load_times = models.warmup(["embedding", "reranker", "llm"])
+
+    latencies = [timed(get_embedding, query, is_query=True)[0] for query in queries]
+    stages["embed"] = summarize(latencies)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, "bench.db"))
+        db.create_db(embedding_dim=dim, quantization=args.quantization, compression=args.compression,
+                     prefilter_dim=args.prefilter_dim)
+        latencies = []
+        for start in range(0, args.docs, args.batch_size):
+            count = min(args.batch_size, args.docs - start)
+            vectors = rng.standard_normal((count, dim)).astype(np.float32)
+            vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+            # The batch offset keeps every text distinct, so no document is skipped as a duplicate
+            texts = [f"{start + i} " + text for i, text in enumerate(synthetic_texts(rng, count, args.doc_words))]
+            latencies.append(timed(db.insert_many, texts, vectors.tolist())[0])
+        stages["insert"] = summarize(latencies, items=args.docs)
+        stages["insert"]["db_size_mb"] = round(os.path.getsize(db.path) / 2**20, 1)
+
+        store = get_vector_store(db, args.vector_store)
+        query_embeddings = [embed_query(query) for query in queries]
+        latencies, results = [], []
+        for query_embedding in query_embeddings:
+            elapsed, rows = timed(store.get_query, query_embedding, k=args.k)
+            latencies.append(elapsed)
+            results.append(rows)
+        stages["query"] = summarize(latencies)
+
+        latencies = [timed(get_reranker, query, [row[0] for row in rows])[0] for query, rows in zip(queries, results)]
+        stages["rerank"] = summarize(latencies, items=sum(len(rows) for rows in results))
+
+        ttft, totals, tokens = [], [], 0
+        for query in queries[:args.llm_queries]:
+            start = time.perf_counter()
+            first = None
+            for _ in get_llm_stream([{"role": "user", "content": query}]):
+                first = first or time.perf_counter()
+                tokens += 1
+            end = time.perf_counter()
+            ttft.append((first or end) - start)
+            totals.append(end - start)
+        stages["llm"] = summarize(totals)
+        stages["llm"]["ttft_p50_ms"] = float(np.percentile(ttft, 50) * 1000)
+        stages["llm"]["tokens_per_s"] = tokens / sum(totals) if sum(totals) else 0.0
+
+        latencies = []
+        for query in queries[:args.llm_queries]:
+            start = time.perf_counter()
+            rows = retrieve(db, query, k=args.k, mode="vector", store=store)
+            scores = get_reranker(query, [row[0] for row in rows])
+            documents = [row[0] for row, score in sorted(zip(rows, scores), key=lambda x: x[1], reverse=True) if score >= 0]
+            if documents:
+                for _ in get_llm_stream(build_rag_prompt(query, documents)["messages"]):
+                    pass
+            latencies.append(time.perf_counter() - start)
+        stages["pipeline"] = summarize(latencies)
+        db.close()
+
+    return {
+        "config": {
+            "models": args.models,
+            "docs": args.docs,
+            "dim": dim,
+            "queries": args.queries,
+            "k": args.k,
+            "quantization": args.quantization,
+            "compression": args.compression,
+            "prefilter_dim": args.prefilter_dim,
+            "vector_store": args.vector_store,
+            "batch_size": args.batch_size,
+            "load_seconds": load_times
+        },
+        "stages": stages
+    }
+
+
+def print_results(results: dict, baseline: dict = None):
+    columns = ["p50_ms", "p95_ms", "p99_ms", "throughput_per_s", "peak_rss_mb"]
+    print(f"{'stage':<10}" + "".join(f"{column:>18}" for column in columns))
+    for stage, values in results["stages"].items():
+        line = f"{stage:<10}"
+        for column in columns:
+            cell = f"{values[column]:.2f}"
+            if baseline and stage in baseline["stages"] and baseline["stages"][stage].get(column):
+                change = (values[column] / baseline["stages"][stage][column] - 1) * 100
+                cell += f" ({change:+.0f}%)"
+            line += f"{cell:>18}"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--models", choices=["stub", "real"], default="stub")
+    parser.add_argument("--docs", type=int, default=10000, help="documents in the synthetic corpus")
+    parser.add_argument("--dim", type=int, default=768, help="embedding dimension of the stub embedder")
+    parser.add_argument("--doc-words", type=int, default=60, help="words per synthetic document")
+    parser.add_argument("--batch-size", type=int, default=1000, help="documents per insert_many call")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--llm-queries", type=int, default=20, help="queries for the llm and pipeline stages")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--quantization", choices=["int8", "bit"], default=IngestConfig.get_ingest_info()["quantization"])
+    parser.add_argument("--prefilter-dim", type=int, default=IngestConfig.get_ingest_info()["prefilter_dim"],
+                        help="dimensions of the truncated first-pass vectors")
+    parser.add_argument("--compression", choices=["zlib", "zstd"], default=IngestConfig.get_ingest_info()["compression"])
+    parser.add_argument("--vector-store", choices=["sqlite", "numpy"], default="sqlite")
+    parser.add_argument("--answer-tokens", type=int, default=64, help="tokens per stub LLM answer")
+    parser.add_argument("--token-delay-ms", type=float, default=0, help="stub LLM delay per token")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--compare", help="results JSON of an earlier run to compare against")
+    args = parser.parse_args()
+
+    results = run(args)
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print(f"{results['config']['docs']} documents, dimension {results['config']['dim']}, {args.models} models")
+    print_results(results, baseline)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
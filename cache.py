@@ -0,0 +1,272 @@
+"""
+Caches for TinyRAG
+"""
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Hashable, List, Optional, Tuple
+
+import numpy as np
+import sqlite_vec
+from sqlite_vec import serialize_float32
+
+
+def normalize_text(text: str) -> str:
+    """Normalize text for use in a cache key (NFKC, collapsed whitespace)"""
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+
+class LRUCache:
+    """Thread-safe bounded LRU cache with hit/miss counters"""
+
+    def __init__(self, max_size: int = 1024):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Get a value and mark it as most recently used"""
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key: Hashable, value: Any):
+        """Store a value, evicting the least recently used entry when full"""
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        """Return hit/miss counters"""
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0
+        }
+
+
+class QueryEmbeddingCache(LRUCache):
+    """
+    LRU cache of query embeddings, optionally persisted to a SQLite table
+
+    With a path, embeddings missing from memory are looked up on disk before
+    being recomputed, so the cache survives restarts. The table keeps at most
+    max_size entries, dropping the least recently used.
+    """
+
+    def __init__(self, max_size: int = 1024, path: Optional[str] = None):
+        super().__init__(max_size)
+        self.disk_hits = 0
+        self._puts = 0
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("""CREATE TABLE IF NOT EXISTS query_embeddings(
+                   key TEXT PRIMARY KEY,
+                   embedding BLOB NOT NULL,
+                   last_used REAL NOT NULL
+            );""")
+            self._db.commit()
+            self._db_lock = threading.Lock()
+
+    def get(self, key: str, default: Any = None) -> Optional[List[float]]:
+        embedding = super().get(key)
+        if embedding is not None or self._db is None:
+            return default if embedding is None else embedding
+
+        with self._db_lock:
+            row = self._db.execute("SELECT embedding FROM query_embeddings WHERE key = ?", [key]).fetchone()
+            if row is None:
+                return default
+            with self._db:
+                self._db.execute("UPDATE query_embeddings SET last_used = ? WHERE key = ?", [time.time(), key])
+        self.disk_hits += 1
+        embedding = np.frombuffer(row[0], dtype=np.float32).tolist()
+        super().put(key, embedding)
+        return embedding
+
+    def put(self, key: str, embedding: List[float]):
+        super().put(key, embedding)
+        if self._db is None:
+            return
+        with self._db_lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO query_embeddings(key, embedding, last_used) VALUES(?, ?, ?)",
+                [key, np.asarray(embedding, dtype=np.float32).tobytes(), time.time()],
+            )
+            self._puts += 1
+            if self._puts % 100 == 0: # trim the table now and then rather than on every insert
+                self._db.execute(
+                    """DELETE FROM query_embeddings WHERE key NOT IN (
+                       SELECT key FROM query_embeddings ORDER BY last_used DESC LIMIT ?
+                    )""",
+                    [self.max_size],
+                )
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        stats["disk_hits"] = self.disk_hits
+        return stats
+
+
+class SemanticCache:
+    """
+    Cache of final answers looked up by query similarity
+
+    Stores (query embedding, retrieved document ids, answer, references) in a
+    sqlite-vec table. A new query whose embedding is within max_distance
+    (cosine) of a cached query that retrieved the same documents gets the
+    cached answer and references.
+    Entries expire after ttl seconds, the least recently used are evicted
+    beyond max_entries, and everything is dropped when the document database's
+    data version changes.
+    """
+
+    def __init__(self, path: str, max_distance: float = 0.05, ttl: float = 86400, max_entries: int = 10000):
+        self.max_distance = max_distance
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.enable_load_extension(True)
+        sqlite_vec.load(self._db) # load sqlite-vec
+        self._db.enable_load_extension(False)
+        self._db.execute("""CREATE TABLE IF NOT EXISTS answers(
+               answer_id INTEGER PRIMARY KEY,
+               document_ids TEXT NOT NULL,
+               answer TEXT NOT NULL,
+               "references" TEXT NOT NULL DEFAULT '',
+               created_at REAL NOT NULL,
+               last_used REAL NOT NULL
+        );""")
+        self._db.execute("CREATE TABLE IF NOT EXISTS cache_settings(key TEXT PRIMARY KEY, value TEXT)")
+        self._db.commit()
+        self._has_vectors = self._db.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'vec_answers'"
+        ).fetchone() is not None
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(answers)")]
+        if "references" not in columns: # caches from before references were stored apart: the answers include them
+            with self._db:
+                self._db.execute("""ALTER TABLE answers ADD COLUMN "references" TEXT NOT NULL DEFAULT ''""")
+                if self._has_vectors:
+                    self._db.execute("DELETE FROM vec_answers")
+                self._db.execute("DELETE FROM answers")
+
+    @staticmethod
+    def _document_key(document_ids) -> str:
+        return ",".join(str(i) for i in sorted(document_ids))
+
+    def _check_data_version(self, data_version: str):
+        """Drop every entry if the document database changed since they were stored"""
+        row = self._db.execute("SELECT value FROM cache_settings WHERE key = 'data_version'").fetchone()
+        if row is not None and row[0] == data_version:
+            return
+        with self._db:
+            if self._has_vectors:
+                self._db.execute("DELETE FROM vec_answers")
+            self._db.execute("DELETE FROM answers")
+            self._db.execute("INSERT OR REPLACE INTO cache_settings(key, value) VALUES('data_version', ?)", [data_version])
+
+    def lookup(self, query_embedding, document_ids, data_version: str = "0") -> Optional[Tuple[str, str]]:
+        """
+        Return the cached (answer, references) for a similar query with the same documents, or None
+
+        Args:
+            query_embedding: Embedding of the new query
+            document_ids: Ids of the documents retrieved for it
+            data_version: Database.get_data_version() of the document database
+        """
+        with self._lock:
+            self._check_data_version(data_version)
+            if not self._has_vectors:
+                self.misses += 1
+                return None
+            rows = self._db.execute(
+                """
+                SELECT a.answer_id, a.answer, a."references", a.document_ids, a.created_at, v.distance FROM (
+                  SELECT answer_id, distance FROM vec_answers
+                  WHERE query_embedding MATCH ? AND k = 5
+                ) v JOIN answers a ON a.answer_id = v.answer_id
+                ORDER BY v.distance
+                """,
+                [serialize_float32(query_embedding)],
+            ).fetchall()
+            now = time.time()
+            key = self._document_key(document_ids)
+            for answer_id, answer, references, stored_key, created_at, distance in rows:
+                if distance <= self.max_distance and stored_key == key and now - created_at <= self.ttl:
+                    with self._db:
+                        self._db.execute("UPDATE answers SET last_used = ? WHERE answer_id = ?", [now, answer_id])
+                    self.hits += 1
+                    return answer, references
+            self.misses += 1
+            return None
+
+    def store(self, query_embedding, document_ids, answer: str, references: str, data_version: str = "0"):
+        """Store the final answer for a query and the references shown with it"""
+        with self._lock:
+            self._check_data_version(data_version)
+            if not self._has_vectors:
+                self._db.execute(f"""CREATE virtual table IF NOT EXISTS vec_answers using vec0(
+                       answer_id INTEGER PRIMARY KEY,
+                       query_embedding FLOAT[{len(query_embedding)}] distance_metric=cosine
+                );""")
+                self._has_vectors = True
+            now = time.time()
+            with self._db:
+                answer_id = self._db.execute(
+                    """INSERT INTO answers(document_ids, answer, "references", created_at, last_used)
+                       VALUES(?, ?, ?, ?, ?)""",
+                    [self._document_key(document_ids), answer, references, now, now],
+                ).lastrowid
+                self._db.execute(
+                    "INSERT INTO vec_answers(answer_id, query_embedding) VALUES(?, ?)",
+                    [answer_id, serialize_float32(query_embedding)],
+                )
+                # Evict expired entries, then the least recently used beyond max_entries
+                stale = [row[0] for row in self._db.execute(
+                    """SELECT answer_id FROM answers WHERE created_at < ? OR answer_id IN (
+                       SELECT answer_id FROM answers ORDER BY last_used DESC LIMIT -1 OFFSET ?
+                    )""",
+                    [now - self.ttl, self.max_entries],
+                )]
+                self._db.executemany("DELETE FROM vec_answers WHERE answer_id = ?", [(i,) for i in stale])
+                self._db.executemany("DELETE FROM answers WHERE answer_id = ?", [(i,) for i in stale])
+
+    @staticmethod
+    def replay(answer: str, words_per_chunk: int = 4):
+        """Yield a cached answer as deltas of a few words, like a streamed LLM response"""
+        words = answer.split(" ")
+        for start in range(0, len(words), words_per_chunk):
+            end = start + words_per_chunk
+            yield " ".join(words[start:end]) + (" " if end < len(words) else "")
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0
+        }
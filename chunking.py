@@ -0,0 +1,154 @@
+"""
+Document chunking for TinyRAG
+
+Splits documents into chunks of at most chunk_size tokens before embedding.
+Chunks never cross a markdown heading (a heading with no text of its own is
+kept with the section after it), are built from whole paragraphs and
+sentences where possible, and consecutive chunks of a section share up to
+overlap tokens, also when a long sentence had to be cut.
+"""
+import re
+from typing import Callable, List, Tuple
+
+HEADING_RE = re.compile(r"^#{1,6}\s", re.MULTILINE)
+PARAGRAPH_RE = re.compile(r"\n\s*\n")
+SENTENCE_RE = re.compile(r"(?<=[.!?。！？])\s+|(?<=[。！？])")
+
+
+def split_sections(text: str) -> List[str]:
+    """Split markdown text into sections, each starting at a heading; heading-only sections join the next one"""
+    starts = [m.start() for m in HEADING_RE.finditer(text)]
+    if not starts or starts[0] != 0:
+        starts.insert(0, 0)
+    starts.append(len(text))
+    sections = []
+    pending = "" # headings with no text of their own, e.g. "# Title" right before "## Chapter 1"
+    for a, b in zip(starts, starts[1:]):
+        section = text[a:b].strip()
+        if not section:
+            continue
+        if HEADING_RE.match(section) and "\n" not in section:
+            pending = f"{pending}\n\n{section}" if pending else section
+            continue
+        sections.append(f"{pending}\n\n{section}" if pending else section)
+        pending = ""
+    if pending:
+        sections.append(pending)
+    return sections
+
+
+def _split_long(piece: str, count_tokens: Callable[[str], int], chunk_size: int) -> List[str]:
+    """Split a piece that is longer than chunk_size tokens on words, then characters"""
+    words = piece.split()
+    if len(words) > 1:
+        parts, current = [], ""
+        for word in words:
+            candidate = f"{current} {word}" if current else word
+            if current and count_tokens(candidate) > chunk_size:
+                parts.append(current)
+                current = word
+            else:
+                current = candidate
+        parts.append(current)
+    else:
+        parts = [piece]
+
+    result = []
+    for part in parts:
+        tokens = count_tokens(part)
+        if tokens <= chunk_size:
+            result.append(part)
+            continue
+        # No spaces to split on (e.g. Thai, Japanese): cut by characters in proportion to tokens
+        step = max(1, len(part) * chunk_size // tokens)
+        result.extend(part[i:i + step] for i in range(0, len(part), step))
+    return result
+
+
+def _tail(piece: str, count_tokens: Callable[[str], int], max_tokens: int) -> str:
+    """Return the end of a piece, at most max_tokens long, cut on words (or characters without spaces)"""
+    if max_tokens <= 0:
+        return ""
+    words = piece.split()
+    if len(words) > 1:
+        tail = ""
+        for word in reversed(words):
+            candidate = f"{word} {tail}" if tail else word
+            if count_tokens(candidate) > max_tokens:
+                break
+            tail = candidate
+        return tail
+    tokens = count_tokens(piece)
+    return piece[-max(1, len(piece) * max_tokens // tokens):] if tokens > max_tokens else piece
+
+
+def _units(section: str, count_tokens: Callable[[str], int], chunk_size: int,
+           overlap: int = 0) -> List[Tuple[str, str, int]]:
+    """Break a section into (separator, text, tokens) units; pieces of long sentences leave room for the overlap"""
+    units = []
+    for paragraph in PARAGRAPH_RE.split(section):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        separator = "\n\n"
+        for sentence in SENTENCE_RE.split(paragraph):
+            sentence = sentence.strip()
+            if not sentence:
+                continue
+            tokens = count_tokens(sentence)
+            pieces = [(sentence, tokens)] if tokens <= chunk_size else [
+                (piece, count_tokens(piece))
+                for piece in _split_long(sentence, count_tokens, max(1, chunk_size - overlap))
+            ]
+            for piece, piece_tokens in pieces:
+                units.append((separator, piece, piece_tokens))
+                separator = " "
+    return units
+
+
+def _join(units) -> str:
+    return "".join(separator + text for separator, text, _ in units).strip()
+
+
+def chunk_text(text: str, count_tokens: Callable[[str], int], chunk_size: int = 256, overlap: int = 32) -> List[str]:
+    """
+    Split text into chunks for embedding
+
+    Args:
+        text: Document text (markdown headings and blank-line paragraphs are respected)
+        count_tokens: Function returning the number of tokens in a string
+        chunk_size: Maximum tokens per chunk
+        overlap: Tokens repeated from the end of the previous chunk in the same section (less than chunk_size)
+
+    Returns:
+        List of chunk texts (a short document is returned as a single chunk)
+    """
+    if not 0 <= overlap < chunk_size:
+        raise ValueError(f"Invalid overlap: {overlap}. Must be at least 0 and less than chunk_size ({chunk_size})")
+    if count_tokens(text) <= chunk_size:
+        return [text]
+
+    chunks = []
+    for section in split_sections(text):
+        current, current_tokens = [], 0
+        for unit in _units(section, count_tokens, chunk_size, overlap):
+            if current and current_tokens + unit[2] > chunk_size:
+                chunks.append(_join(current))
+                # Carry the tail of the previous chunk over as overlap
+                tail, tail_tokens = [], 0
+                for previous in reversed(current):
+                    if tail_tokens + previous[2] > overlap or tail_tokens + previous[2] + unit[2] > chunk_size:
+                        break
+                    tail.insert(0, previous)
+                    tail_tokens += previous[2]
+                if not tail: # the last unit is longer than the overlap (e.g. a piece of a cut sentence): take its end
+                    separator, previous, _ = current[-1]
+                    text = _tail(previous, count_tokens, min(overlap, chunk_size - unit[2]))
+                    if text:
+                        tail, tail_tokens = [(separator, text, count_tokens(text))], count_tokens(text)
+                current, current_tokens = tail, tail_tokens
+            current.append(unit)
+            current_tokens += unit[2]
+        if current:
+            chunks.append(_join(current))
+    return chunks
@@ -6,12 +6,13 @@ import os
 class EmbeddingConfig:
     """Embedding model configuration"""
     # Available model types
-    AVAILABLE_TYPES = ["llama-cpp", "sentence-transformers"]
+    AVAILABLE_TYPES = ["llama-cpp", "sentence-transformers", "onnx"]
     
     # Available models for each type
     AVAILABLE_MODELS = {
         "llama-cpp": ["bge-m3"],
-        "sentence-transformers": ["ruri-v3-310m", "intfloat/multilingual-e5-base", "BAAI/bge-m3"]
+        "sentence-transformers": ["ruri-v3-310m", "intfloat/multilingual-e5-base", "BAAI/bge-m3"],
+        "onnx": ["ruri-v3-310m", "bge-m3"]  # int8 exports run with onnxruntime (see onnx_models.py)
     }
     
     @classmethod
@@ -37,6 +38,172 @@ class EmbeddingConfig:
         os.environ["EMBEDDING_MODEL_NAME"] = model_name
 
 
+class OnnxConfig:
+    """ONNX Runtime backend of the embedding model and the reranker (see onnx_models.py)"""
+
+    @classmethod
+    def get_onnx_info(cls):
+        """Get ONNX Runtime settings from environment variables"""
+        return {
+            "model_dir": os.getenv("ONNX_MODEL_DIR", "onnx_models"),  # int8 exports, one directory per model
+            "threads": int(os.getenv("ONNX_THREADS", "0")),  # intra-op threads (0 = OMP_NUM_THREADS or all cores)
+            "max_length": int(os.getenv("ONNX_MAX_LENGTH", "0")),  # tokens per input (0 = model limit)
+            "batch_size": int(os.getenv("ONNX_BATCH_SIZE", "16"))  # reranker pairs per inference call
+        }
+
+
+class DatabaseConfig:
+    """SQLite connection settings"""
+
+    @classmethod
+    def get_database_info(cls):
+        """Get connection settings from environment variables"""
+        return {
+            "wal": os.getenv("DB_WAL", "1") == "1",  # WAL journaling: queries are not blocked by an ingest
+            "read_pool": os.getenv("DB_READ_POOL", "1") == "1",  # one read-only connection per thread for queries
+            "mmap_size": int(os.getenv("DB_MMAP_SIZE", str(256 * 2**20))),  # bytes of the file memory-mapped
+            "cache_size": int(os.getenv("DB_CACHE_SIZE", "65536")),  # page cache per connection in KiB
+            "busy_timeout": int(os.getenv("DB_BUSY_TIMEOUT", "5000"))  # ms to wait for a lock
+        }
+
+
+class IngestConfig:
+    """Ingestion pipeline configuration"""
+
+    @classmethod
+    def get_ingest_info(cls):
+        """Get current ingestion configuration"""
+        chunk_size = int(os.getenv("CHUNK_SIZE", "256"))
+        chunk_overlap = int(os.getenv("CHUNK_OVERLAP", "32"))
+        if chunk_size > 0 and not 0 <= chunk_overlap < chunk_size:
+            raise ValueError(f"Invalid CHUNK_OVERLAP: {chunk_overlap}. Must be at least 0 and less than CHUNK_SIZE ({chunk_size})")
+        return {
+            "workers": int(os.getenv("INGEST_WORKERS", "1")),  # embedding worker processes (1 = in-process)
+            "batch_size": int(os.getenv("INGEST_BATCH_SIZE", "32")),  # documents per batch
+            "queue_size": int(os.getenv("INGEST_QUEUE_SIZE", "4")),  # max batches waiting per queue
+            "prune": os.getenv("INGEST_PRUNE", "0") == "1",  # delete documents missing from the dataset
+            "streaming": os.getenv("DATASET_STREAMING", "0") == "1",  # read datasets from the hub as they download
+            "chunk_size": chunk_size,  # max tokens per chunk (0 = no chunking)
+            "chunk_overlap": chunk_overlap,  # tokens shared by consecutive chunks, less than chunk_size
+            "quantization": os.getenv("VECTOR_QUANTIZATION") or None,  # None, "int8" or "bit" for new databases
+            "prefilter_dim": int(os.getenv("VECTOR_PREFILTER_DIM", "0")) or None,  # truncated first-pass vectors
+            "compression": os.getenv("DOCUMENT_COMPRESSION") or None  # None, "zlib" or "zstd" for new databases
+        }
+
+
+class RetrievalConfig:
+    """Retrieval configuration"""
+    # vector: KNN only, hybrid: BM25 + KNN with rank fusion, lexical: BM25 only (no query embedding)
+    AVAILABLE_MODES = ["vector", "hybrid", "lexical"]
+
+    @classmethod
+    def get_retrieval_info(cls):
+        """Get current retrieval configuration"""
+        mode = os.getenv("RETRIEVAL_MODE", "vector")
+        if mode not in cls.AVAILABLE_MODES:
+            raise ValueError(f"Invalid retrieval mode: {mode}. Available: {cls.AVAILABLE_MODES}")
+        return {
+            "mode": mode,
+            "candidates": int(os.getenv("RETRIEVAL_CANDIDATES", "20")),  # results per ranking before fusion
+            "rrf_k": int(os.getenv("RETRIEVAL_RRF_K", "60")),  # reciprocal rank fusion constant
+            "oversample": int(os.getenv("RETRIEVAL_OVERSAMPLE", "8")),  # candidates per result on quantized databases
+            "vector_store": os.getenv("VECTOR_STORE", "sqlite")  # "sqlite" (vec0 table) or "numpy" (memory-mapped matrix)
+        }
+
+
+class RerankConfig:
+    """Reranker configuration"""
+
+    @classmethod
+    def get_rerank_info(cls):
+        """Get current reranker configuration"""
+        return {
+            "backend": os.getenv("RERANK_BACKEND", "llama-cpp"),  # "llama-cpp" (GGUF) or "onnx" (int8, CPU)
+            "cache_size": int(os.getenv("RERANK_CACHE_SIZE", "4096")),  # cached (query, document) scores (0 = disabled)
+            # Cascade on vector distances (0 = disabled):
+            "skip_margin": float(os.getenv("RERANK_SKIP_MARGIN", "0")),  # accept the top hit unreranked if 2nd is this much farther
+            "max_gap": float(os.getenv("RERANK_MAX_GAP", "0")),  # only rerank hits within this distance of the best
+            "max_docs": int(os.getenv("RERANK_MAX_DOCS", "0"))  # rerank at most this many hits
+        }
+
+
+class ServingConfig:
+    """Query serving configuration"""
+
+    @classmethod
+    def get_serving_info(cls):
+        """Get current serving configuration"""
+        return {
+            "micro_batch": os.getenv("MICRO_BATCH", "0") == "1",  # batch concurrent query embeddings / reranker pairs
+            "micro_batch_size": int(os.getenv("MICRO_BATCH_SIZE", "32")),  # max items per batched model call
+            "micro_batch_wait_ms": float(os.getenv("MICRO_BATCH_WAIT_MS", "5")),  # max wait for more items
+            "concurrency": int(os.getenv("SERVING_CONCURRENCY", "1")),  # Gradio requests handled at the same time
+            "stream_interval_ms": float(os.getenv("STREAM_INTERVAL_MS", "50")),  # merge answer deltas for this long
+            "stream_max_bytes": int(os.getenv("STREAM_MAX_BYTES", "0")),  # or until this many bytes (0 = no limit)
+            "sse_api": os.getenv("SSE_API", "0") == "1",  # serve /api/answer as Server-Sent Events next to the UI
+            "host": os.getenv("GRADIO_SERVER_NAME", "127.0.0.1"),  # used when SSE_API=1
+            "port": int(os.getenv("GRADIO_SERVER_PORT", "7860")),
+            "llm_workers": int(os.getenv("LLM_WORKERS", "0")),  # LLM worker processes (0 = in-process model)
+            "llm_queue_size": int(os.getenv("LLM_QUEUE_SIZE", "8")),  # requests allowed to wait for a worker
+            "llm_queue_timeout": float(os.getenv("LLM_QUEUE_TIMEOUT", "30")),  # seconds to wait before rejecting
+            "llm_threads": int(os.getenv("LLM_THREADS", "0")),  # OMP threads per worker (0 = default)
+            "pipeline_workers": int(os.getenv("PIPELINE_WORKERS", "4")),  # threads for embed/retrieve/rerank calls
+            "stage_timeouts": {  # seconds per stage of the async pipeline (0 = no limit)
+                "embed": float(os.getenv("PIPELINE_EMBED_TIMEOUT", "0")),
+                "retrieve": float(os.getenv("PIPELINE_RETRIEVE_TIMEOUT", "0")),
+                "rerank": float(os.getenv("PIPELINE_RERANK_TIMEOUT", "0")),
+                "llm": float(os.getenv("PIPELINE_LLM_TIMEOUT", "0"))  # whole answer generation
+            }
+        }
+
+
+class TracingConfig:
+    """Per-stage latency tracing (see tracing.py)"""
+
+    @classmethod
+    def get_tracing_info(cls):
+        """Get tracing settings from environment variables"""
+        exporters = os.getenv("TRACE_EXPORTERS", "")
+        return {
+            "exporters": [name.strip() for name in exporters.split(",") if name.strip()],  # log, jsonl, prometheus
+            "jsonl_path": os.getenv("TRACE_JSONL_PATH", "traces.jsonl"),
+            "prometheus_port": int(os.getenv("TRACE_PROMETHEUS_PORT", "9464")),  # /metrics (0 = not served)
+            "prometheus_host": os.getenv("TRACE_PROMETHEUS_HOST", "127.0.0.1")  # 0.0.0.0 to expose it to other hosts
+        }
+
+
+class PromptConfig:
+    """Token budget of the prompt sent to the LLM (n_ctx is 16384, the rest is left for the answer)"""
+
+    @classmethod
+    def get_prompt_info(cls):
+        """Get prompt packing settings from environment variables"""
+        return {
+            "budget": int(os.getenv("PROMPT_TOKEN_BUDGET", "4096")),  # max tokens of history + RAG prompt
+            "history_budget": int(os.getenv("PROMPT_HISTORY_BUDGET", "1024")),  # max tokens of chat history
+            "min_document_tokens": int(os.getenv("PROMPT_MIN_DOCUMENT_TOKENS", "64"))  # drop rather than truncate below this
+        }
+
+
+class CacheConfig:
+    """Cache configuration"""
+
+    @classmethod
+    def get_cache_info(cls):
+        """Get current cache configuration"""
+        return {
+            "query_cache_size": int(os.getenv("QUERY_CACHE_SIZE", "1024")),  # query embeddings kept (0 = disabled)
+            "query_cache_path": os.getenv("QUERY_CACHE_PATH") or None,  # SQLite file to persist them to
+            "semantic_cache": os.getenv("SEMANTIC_CACHE", "0") == "1",  # replay answers for similar queries
+            "semantic_cache_distance": float(os.getenv("SEMANTIC_CACHE_DISTANCE", "0.05")),  # max cosine distance
+            "semantic_cache_ttl": float(os.getenv("SEMANTIC_CACHE_TTL", "86400")),  # seconds an answer is kept
+            "semantic_cache_size": int(os.getenv("SEMANTIC_CACHE_SIZE", "10000")),  # max cached answers
+            "llm_prompt_cache": os.getenv("LLM_PROMPT_CACHE") or None,  # None, "ram" or "disk": reuse KV state of prompt prefixes
+            "llm_prompt_cache_mb": int(os.getenv("LLM_PROMPT_CACHE_MB", "2048")),  # size limit, least recently used evicted
+            "llm_prompt_cache_path": os.getenv("LLM_PROMPT_CACHE_PATH", ".cache/llm_prompt_cache")  # directory for "disk"
+        }
+
+
 class LanguageConfig:
     # Set default language to English
     DEFAULT_LANGUAGE = "en"
@@ -45,6 +212,8 @@ class LanguageConfig:
     MESSAGES = {
         "en": {
             "no_results_error": "Sorry, I cannot answer this question from the database. No relevant documents found.",
+            "busy_error": "The server is busy. Please try again in a moment.",
+            "timeout_error": "Sorry, answering took too long. Please try again.",
             "rag_prompt": """
 DOCUMENT:
 {documents}
@@ -59,12 +228,16 @@ If the DOCUMENT doesn't contain the facts to answer the QUESTION, return "I cann
         },
         "th": {
             "no_results_error": "ขออภัย ไม่สามารถตอบคำถามนี้จากฐานข้อมูลได้",
+            "busy_error": "ขออภัย ขณะนี้ระบบมีผู้ใช้งานจำนวนมาก กรุณาลองใหม่อีกครั้ง",
+            "timeout_error": "ขออภัย ระบบใช้เวลาตอบนานเกินไป กรุณาลองใหม่อีกครั้ง",
             "rag_prompt": """คำถาม: {query}
 จงตอบคำถามกับกำกับมาตราที่อ้างอิงด้วยข้อมูลต่อไปนี้ ห้ามตอบนอกเหนือจากข้อมูล:
 {documents}"""
         },
         "ja": {
             "no_results_error": "申し訳ありません。データベースからこの質問にお答えできません。関連する文書が見つかりませんでした。",
+            "busy_error": "申し訳ありません。現在混み合っています。しばらくしてから再度お試しください。",
+            "timeout_error": "申し訳ありません。回答に時間がかかりすぎました。もう一度お試しください。",
             "rag_prompt": """
 関連文書:
 {documents}
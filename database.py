@@ -1,39 +1,621 @@
+import hashlib
+import os
+import re
 import sqlite3
+import threading
+import zlib
+from pathlib import Path
+
+import numpy as np
 import sqlite_vec
 from sqlite_vec import serialize_float32
 
+from config import DatabaseConfig
+
+
+def content_hash(text: str) -> str:
+    """Return the hash used to identify a document's contents"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+# Runs of characters that are not whitespace or punctuation (keeps Thai combining vowels and tone marks)
+WORD_RE = re.compile(r"[^\s!-/:-@\[-`{-~。、，！？「」『』（）]+")
+
+
+def fts_query(text: str, max_term_length: int = 6) -> str:
+    """
+    Build an FTS5 MATCH expression for the trigram tokenizer
+
+    Words of 3 to max_term_length characters are matched as phrases, so statute
+    numbers and exact terms match exactly. Shorter words, which the trigram
+    tokenizer cannot match alone, are matched as a phrase with the word before
+    (or after) them, e.g. "มาตรา 5". Longer runs without spaces (Thai or
+    Japanese sentences) are broken into overlapping trigrams. Terms are OR'ed
+    and ranked by BM25.
+    """
+    terms = []
+    words = list(WORD_RE.finditer(text))
+    for index, word in enumerate(words):
+        if len(word.group()) < 3:
+            if index > 0: # end of the previous word, then this one
+                start = max(words[index - 1].start(), words[index - 1].end() - max_term_length)
+                phrase = text[start:word.end()]
+            elif index + 1 < len(words): # this word, then the start of the next one
+                phrase = text[word.start():min(words[index + 1].end(), words[index + 1].start() + max_term_length)]
+            else:
+                continue
+            phrase = " ".join(phrase.split())
+            if len(phrase) >= 3:
+                terms.append(phrase)
+        elif len(word.group()) <= max_term_length:
+            terms.append(word.group())
+        else:
+            word = word.group()
+            terms.extend(word[i:i + 3] for i in range(len(word) - 2))
+    terms = list(dict.fromkeys(terms)) # drop duplicates, keep order
+    return " OR ".join('"' + term.replace('"', '""') + '"' for term in terms)
+
+
+def reciprocal_rank_fusion(rankings, rrf_k: int = 60):
+    """
+    Fuse ranked lists of ids with reciprocal rank fusion
+
+    Returns:
+        List of (id, score) sorted by descending score
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (rrf_k + rank)
+    return sorted(scores.items(), key=lambda x: x[1], reverse=True)
+
+
+# Quantized copy of the embedding used for the first-pass KNN scan: (column type, SQL quantizer)
+QUANTIZATIONS = {
+    "int8": ("INT8", "vec_quantize_int8(vec_normalize({}), 'unit')"),
+    "bit": ("BIT", "vec_quantize_binary({})"),
+}
+
+
+def coarse_sql(vector_sql: str, quantization=None, prefilter_dim=None) -> str:
+    """
+    SQL of the coarse copy of an embedding scanned in the first KNN pass
+
+    The first prefilter_dim dimensions, renormalized (Matryoshka-style
+    truncation), and/or quantized.
+    """
+    if prefilter_dim:
+        vector_sql = f"vec_normalize(vec_slice({vector_sql}, 0, {int(prefilter_dim)}))"
+    if quantization:
+        return QUANTIZATIONS[quantization][1].format(vector_sql)
+    return vector_sql
+
+
+def _zstd_codec():
+    import zstandard # optional dependency, only needed for DOCUMENT_COMPRESSION=zstd
+    return zstandard.ZstdCompressor(level=9).compress, zstandard.ZstdDecompressor().decompress
+
+
+# Compression of the document texts in the documents table: returns the (compress, decompress) functions of bytes
+COMPRESSIONS = {
+    "zlib": lambda: (lambda data: zlib.compress(data, 9), zlib.decompress),
+    "zstd": _zstd_codec,
+}
+
 
 class Database:
+    """
+    sqlite-vec document database
+
+    vec_documents (vec0) holds only the embeddings; document texts and their
+    parent/chunk metadata live in the regular documents table, optionally
+    compressed. In a quantized or prefiltered database vec_documents holds
+    only the coarse vectors it scans, and the full vectors used for rescoring
+    are stored as float16 in the embeddings table. Searches rank ids first and read the texts of the final rows
+    in one query. Databases created before this layout keep their texts in
+    vec_documents and are still read.
+
+    self.db is the single writer connection, used for creating tables,
+    ingestion and deletes (serialized by a lock). Queries go through
+    self.reader, a read-only connection per thread, so concurrent queries do
+    not share a connection. With WAL journaling, readers see the last committed
+    data and are not blocked while an ingest writes.
+    """
+
     def __init__(self,db: str):
+        self.path = db
+        self.config = DatabaseConfig.get_database_info()
         self.db = sqlite3.connect(db, check_same_thread=False) # db.db is the database file.
-        self.db.enable_load_extension(True)
-        sqlite_vec.load(self.db) # load sqlite-vec
-        self.db.enable_load_extension(False)
+        self._load_extension(self.db)
+        self._apply_pragmas(self.db)
+        if self.config["wal"]:
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL") # safe with WAL, fewer fsyncs per commit
+        self._write_lock = threading.RLock()
+        self._local = threading.local()
+        self._readers = []
+        self._readers_lock = threading.Lock()
+        self._settings = None
+        self._codec = None
+
+    @staticmethod
+    def _load_extension(connection):
+        connection.enable_load_extension(True)
+        sqlite_vec.load(connection) # load sqlite-vec
+        connection.enable_load_extension(False)
+
+    def _apply_pragmas(self, connection):
+        connection.execute(f"PRAGMA mmap_size={self.config['mmap_size']}")
+        connection.execute(f"PRAGMA cache_size=-{self.config['cache_size']}") # negative = KiB
+        connection.execute(f"PRAGMA busy_timeout={self.config['busy_timeout']}")
+        connection.execute("PRAGMA temp_store=MEMORY")
+
+    @property
+    def reader(self):
+        """
+        Read-only connection of the calling thread, opened on first use
+
+        Falls back to the writer connection when the read pool is disabled
+        (DB_READ_POOL=0) or the database is in memory / not created yet.
+        """
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            return connection
+        if not self.config["read_pool"] or self.path == ":memory:" or not os.path.exists(self.path):
+            return self.db
+        connection = sqlite3.connect(Path(self.path).absolute().as_uri() + "?mode=ro", uri=True, check_same_thread=False)
+        self._load_extension(connection)
+        self._apply_pragmas(connection)
+        self._local.connection = connection
+        with self._readers_lock:
+            self._readers.append(connection)
+        return connection
+
+    def close(self):
+        """Close every connection"""
+        with self._readers_lock:
+            for connection in self._readers:
+                connection.close()
+            self._readers.clear()
+        self.db.close()
+
+    @property
+    def settings(self):
+        """Settings the database was created with (e.g. quantization)"""
+        if self._settings is None:
+            try:
+                self._settings = dict(self.db.execute("SELECT key, value FROM settings").fetchall())
+            except sqlite3.OperationalError: # databases created before settings were stored
+                self._settings = {}
+        return self._settings
+
+    @property
+    def legacy_layout(self) -> bool:
+        """True for databases created with the texts in vec_documents"""
+        return self.settings.get("layout") != "table"
+
+    def _encode(self, text: str):
+        compression = self.settings.get("compression")
+        if not compression:
+            return text
+        if self._codec is None:
+            self._codec = COMPRESSIONS[compression]()
+        return self._codec[0](text.encode("utf-8"))
+
+    def _decode(self, value) -> str:
+        if isinstance(value, str) or value is None:
+            return value
+        if self._codec is None:
+            self._codec = COMPRESSIONS[self.settings["compression"]]()
+        return self._codec[1](value).decode("utf-8")
+
+    @property
+    def rescore_table(self) -> bool:
+        """True if the full vectors are in the embeddings table (float16) instead of vec_documents"""
+        return self.settings.get("rescore_vectors") == "float16"
+
+    def _coarse_sql(self, vector_sql: str):
+        """SQL of the coarse copy of a vector for this database, or None if it has no coarse column"""
+        quantization, prefilter_dim = self.settings.get("quantization"), self.settings.get("prefilter_dim")
+        if not quantization and not prefilter_dim:
+            return None
+        return coarse_sql(vector_sql, quantization, prefilter_dim)
 
-    def create_db(self, embedding_dim=1024):
-        self.db.execute(f"""CREATE virtual table vec_documents using vec0(
+    def create_db(self, embedding_dim=1024, fts_tokenizer="trigram", quantization=None, compression=None,
+                  prefilter_dim=None):
+        """
+        Create the tables, or reuse them if the database already exists
+
+        Args:
+            embedding_dim: Dimension of the embedding vectors
+            fts_tokenizer: FTS5 tokenizer for the full-text index
+            quantization: None, "int8" or "bit". Stores a quantized copy of each
+                embedding; get_query scans it first and rescores with the full vectors,
+                kept as float16 outside the scanned table. Fixed when the database is created.
+            compression: None, "zlib" or "zstd" (needs the zstandard package). Compresses
+                the document texts. Fixed when the database is created.
+            prefilter_dim: None, or a number of leading dimensions. Also stores the
+                renormalized prefix of each embedding (quantized too if quantization is set);
+                get_query scans the prefixes first and rescores with the full vectors. Only
+                accurate for Matryoshka-trained models. Fixed when the database is created.
+        """
+        if quantization is not None and quantization not in QUANTIZATIONS:
+            raise ValueError(f"Invalid quantization: {quantization}. Available: {list(QUANTIZATIONS)}")
+        if compression is not None and compression not in COMPRESSIONS:
+            raise ValueError(f"Invalid compression: {compression}. Available: {list(COMPRESSIONS)}")
+        if prefilter_dim is not None and not 0 < prefilter_dim < embedding_dim:
+            raise ValueError(f"Invalid prefilter_dim: {prefilter_dim}. Must be between 0 and {embedding_dim}")
+        if prefilter_dim and quantization == "bit" and prefilter_dim % 8:
+            raise ValueError(f"Invalid prefilter_dim: {prefilter_dim}. Must be a multiple of 8 for bit quantization")
+        with self._write_lock:
+            self._create_db(embedding_dim, fts_tokenizer, quantization, compression, prefilter_dim)
+
+    def _create_db(self, embedding_dim, fts_tokenizer, quantization, compression, prefilter_dim):
+        fixed = (("quantization", quantization), ("compression", compression),
+                 ("prefilter_dim", str(prefilter_dim) if prefilter_dim else None))
+        exists = self.db.execute("SELECT 1 FROM sqlite_master WHERE name = 'vec_documents'").fetchone() is not None
+        if exists:
+            for name, value in fixed:
+                if self.settings.get(name) != value:
+                    raise ValueError(
+                        f"Database was created with {name}={self.settings.get(name)}, recreate it to change {name}"
+                    )
+        elif quantization or prefilter_dim:
+            # Only the coarse vectors are scanned; the full ones are read for the candidates only
+            column_type = QUANTIZATIONS[quantization][0] if quantization else "FLOAT"
+            self.db.execute(f"""CREATE virtual table vec_documents using vec0(
+               document_id INTEGER PRIMARY KEY AUTOINCREMENT,
+               contents_embedding_coarse {column_type}[{prefilter_dim or embedding_dim}]
+        );""")
+            # float16: rescoring needs no more precision, and half-size rows pack twice as many per page
+            self.db.execute("""CREATE TABLE embeddings(
+               document_id INTEGER PRIMARY KEY,
+               embedding BLOB NOT NULL
+        );""")
+        else:
+            self.db.execute(f"""CREATE virtual table vec_documents using vec0(
                document_id INTEGER PRIMARY KEY AUTOINCREMENT,
-               contents TEXT,
                contents_embedding FLOAT[{embedding_dim}]
-        );""") # Table vec_documents
+        );""") # Table vec_documents: embeddings only, texts are in documents
+        self.db.execute("CREATE TABLE IF NOT EXISTS settings(key TEXT PRIMARY KEY, value TEXT)")
+        self.db.execute("INSERT OR IGNORE INTO settings(key, value) VALUES('data_version', '0')")
+        if not exists:
+            self.db.execute("INSERT OR REPLACE INTO settings(key, value) VALUES('layout', 'table')")
+            if quantization or prefilter_dim:
+                self.db.execute("INSERT OR REPLACE INTO settings(key, value) VALUES('rescore_vectors', 'float16')")
+        for name, value in fixed:
+            if value:
+                self.db.execute("INSERT OR REPLACE INTO settings(key, value) VALUES(?, ?)", [name, value])
+        self._settings = None
+        self.db.execute("""CREATE TABLE IF NOT EXISTS documents(
+               document_id INTEGER PRIMARY KEY,
+               content_hash TEXT NOT NULL,
+               parent_id INTEGER,
+               chunk_index INTEGER NOT NULL DEFAULT 0,
+               contents BLOB
+        );""") # one row per vec_documents row: hash of the parent document, chunk position and (encoded) text
+        columns = [row[1] for row in self.db.execute("PRAGMA table_info(documents)")]
+        if "parent_id" not in columns: # databases created before chunking
+            self.db.execute("ALTER TABLE documents ADD COLUMN parent_id INTEGER")
+            self.db.execute("ALTER TABLE documents ADD COLUMN chunk_index INTEGER NOT NULL DEFAULT 0")
+            self.db.execute("UPDATE documents SET parent_id = document_id")
+        self.db.execute("CREATE INDEX IF NOT EXISTS documents_content_hash ON documents(content_hash)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS documents_parent_id ON documents(parent_id)")
+        # Full-text index, rowid = vec_documents.document_id. Contentless in the table layout: the texts are in documents
+        self.db.execute(f"""CREATE virtual table IF NOT EXISTS fts_documents using fts5(
+               contents,
+               tokenize='{fts_tokenizer}'{"" if self.legacy_layout else ", content=''"}
+        );""")
         self.db.commit()
+        if not self.legacy_layout:
+            return
+
+        # Databases created before full-text search: index the existing rows once
+        if self.db.execute("SELECT 1 FROM fts_documents LIMIT 1").fetchone() is None:
+            with self.db:
+                self.db.execute("INSERT INTO fts_documents(rowid, contents) SELECT document_id, contents FROM vec_documents")
+
+        # Databases created before content hashing: hash the existing rows once
+        if self.db.execute("SELECT 1 FROM documents LIMIT 1").fetchone() is None:
+            rows = self.db.execute("SELECT document_id, contents FROM vec_documents").fetchall()
+            with self.db:
+                self.db.executemany(
+                    "INSERT INTO documents(document_id, content_hash, parent_id) VALUES(?, ?, ?)",
+                    [(document_id, content_hash(contents), document_id) for document_id, contents in rows],
+                )
 
     def insert(self, content,embedding):
-       with self.db:
-        self.db.execute(
-            "INSERT INTO vec_documents(contents,contents_embedding) VALUES(?, ?)",
-            [content, serialize_float32(embedding)],
-        )
-        self.db.commit()
+        self.insert_many([content], [embedding])
+
+    def insert_many(self, contents, embeddings, parents=None):
+        """
+        Insert documents and their embeddings in a single transaction
+
+        Documents whose contents are already in the database are skipped, so an
+        interrupted ingestion can be re-run and resumes after the last committed batch.
+
+        Args:
+            contents: Texts to store, one row each
+            embeddings: Embedding of each text
+            parents: Optional parent document text of each content when contents are
+                chunks; chunks of the same parent must be consecutive and are linked
+                to one parent_id. By default every content is its own parent.
+
+        Returns:
+            Number of rows inserted
+        """
+        chunked = parents is not None
+        parents = parents or contents
+        hashes = {}
+        for parent in parents:
+            if parent not in hashes:
+                hashes[parent] = content_hash(parent)
+        with self._write_lock, self.db:
+            existing = self.existing_hashes(list(hashes.values()))
+            next_id = self.db.execute("SELECT COALESCE(MAX(document_id), 0) FROM documents").fetchone()[0] + 1
+            rows = []
+            parent_ids = {}
+            last_hash = None
+            for content, embedding, parent in zip(contents, embeddings, parents):
+                h = hashes[parent]
+                # Stored, or repeated in this batch (unless it is the next chunk of the same parent)
+                if h in existing or (h in parent_ids and not (chunked and h == last_hash)):
+                    continue
+                last_hash = h
+                document_id = next_id + len(rows)
+                parent_id = parent_ids.setdefault(h, document_id)
+                rows.append((document_id, content, embedding, h, parent_id, document_id - parent_id))
+            coarse = self._coarse_sql("?3")
+            text_column = ",contents" if self.legacy_layout else ""
+            text_value = ", ?2" if self.legacy_layout else ""
+            if self.rescore_table:
+                sql = f"INSERT INTO vec_documents(document_id,contents_embedding_coarse) VALUES(?1, {coarse})"
+                self.db.executemany(
+                    "INSERT INTO embeddings(document_id, embedding) VALUES(?, ?)",
+                    [(row[0], np.asarray(row[2], dtype=np.float16).tobytes()) for row in rows],
+                )
+            elif coarse:
+                sql = (f"INSERT INTO vec_documents(document_id{text_column},contents_embedding,contents_embedding_coarse) "
+                       f"VALUES(?1{text_value}, ?3, {coarse})")
+            else:
+                sql = f"INSERT INTO vec_documents(document_id{text_column},contents_embedding) VALUES(?1{text_value}, ?3)"
+            self.db.executemany(sql, [(row[0], row[1], serialize_float32(row[2])) for row in rows])
+            if self.legacy_layout:
+                self.db.executemany(
+                    "INSERT INTO documents(document_id, content_hash, parent_id, chunk_index) VALUES(?, ?, ?, ?)",
+                    [(row[0], row[3], row[4], row[5]) for row in rows],
+                )
+            else:
+                self.db.executemany(
+                    "INSERT INTO documents(document_id, content_hash, parent_id, chunk_index, contents) VALUES(?, ?, ?, ?, ?)",
+                    [(row[0], row[3], row[4], row[5], self._encode(row[1])) for row in rows],
+                )
+            self.db.executemany(
+                "INSERT INTO fts_documents(rowid, contents) VALUES(?, ?)",
+                [(row[0], row[1]) for row in rows],
+            )
+            if rows:
+                self._bump_data_version()
+        return len(rows)
+
+    def existing_hashes(self, hashes):
+        """Return the subset of hashes already stored in the database"""
+        found = set()
+        for start in range(0, len(hashes), 500): # stay below SQLite's variable limit
+            chunk = hashes[start:start + 500]
+            found.update(row[0] for row in self.db.execute(
+                f"SELECT content_hash FROM documents WHERE content_hash IN ({','.join('?' * len(chunk))})",
+                chunk,
+            ))
+        return found
+
+    def delete_many(self, contents):
+        """
+        Delete documents by contents in a single transaction
+
+        Returns:
+            Number of documents deleted
+        """
+        return self._delete_hashes([content_hash(content) for content in contents])
+
+    def prune(self, keep_hashes):
+        """
+        Delete every document whose content hash is not in keep_hashes
+
+        Args:
+            keep_hashes: Set of content_hash() values of the documents to keep
+
+        Returns:
+            Number of documents deleted
+        """
+        stored = [row[0] for row in self.db.execute("SELECT DISTINCT content_hash FROM documents")]
+        return self._delete_hashes([h for h in stored if h not in keep_hashes])
+
+    def _delete_hashes(self, hashes):
+        """Delete the rows (every chunk) of the given content hashes; returns the number of documents deleted"""
+        with self._write_lock, self.db:
+            ids, deleted = [], 0
+            for h in hashes:
+                rows = [row[0] for row in self.db.execute(
+                    "SELECT document_id FROM documents WHERE content_hash = ?", [h]
+                )]
+                ids.extend(rows)
+                deleted += 1 if rows else 0
+            if self.legacy_layout:
+                self.db.executemany("DELETE FROM fts_documents WHERE rowid = ?", [(i,) for i in ids])
+            else: # a contentless index is deleted from with the indexed text
+                self.db.executemany(
+                    "INSERT INTO fts_documents(fts_documents, rowid, contents) VALUES('delete', ?, ?)",
+                    list(self._get_contents(self.db, ids).items()),
+                )
+            self.db.executemany("DELETE FROM vec_documents WHERE document_id = ?", [(i,) for i in ids])
+            if self.rescore_table:
+                self.db.executemany("DELETE FROM embeddings WHERE document_id = ?", [(i,) for i in ids])
+            self.db.executemany("DELETE FROM documents WHERE document_id = ?", [(i,) for i in ids])
+            if ids:
+                self._bump_data_version(deleted=True)
+        return deleted
+
+    def _bump_data_version(self, deleted: bool = False):
+        self.db.execute("UPDATE settings SET value = CAST(value AS INTEGER) + 1 WHERE key = 'data_version'")
+        if deleted:
+            self.db.execute("""INSERT INTO settings(key, value) VALUES('delete_version', '1')
+                               ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1""")
+
+    def _get_version(self, key: str) -> str:
+        try:
+            row = self.reader.execute("SELECT value FROM settings WHERE key = ?", [key]).fetchone()
+        except sqlite3.OperationalError: # databases created before settings were stored
+            return "0"
+        return row[0] if row else "0"
+
+    def get_data_version(self) -> str:
+        """Return a value that changes whenever documents are inserted or deleted"""
+        return self._get_version("data_version")
+
+    def get_delete_version(self) -> str:
+        """Return a value that changes whenever documents are deleted (inserts only add higher ids)"""
+        return self._get_version("delete_version")
+
+    def get_contents(self, document_ids):
+        """Return {document_id: contents} of the given documents"""
+        return self._get_contents(self.reader, document_ids)
+
+    def _get_contents(self, connection, document_ids):
+        contents = {}
+        if self.legacy_layout:
+            for document_id in document_ids: # point lookups: vec0 scans the whole table for IN (...)
+                row = connection.execute("SELECT contents FROM vec_documents WHERE document_id = ?", [document_id]).fetchone()
+                if row is not None:
+                    contents[document_id] = row[0]
+            return contents
+        for start in range(0, len(document_ids), 500): # stay below SQLite's variable limit
+            chunk = document_ids[start:start + 500]
+            contents.update((document_id, self._decode(value)) for document_id, value in connection.execute(
+                f"SELECT document_id, contents FROM documents WHERE document_id IN ({','.join('?' * len(chunk))})",
+                chunk,
+            ))
+        return contents
+
+    def get_embeddings(self, after_id: int = 0):
+        """Yield (document_id, float32 vector) of every document with an id above after_id, in id order"""
+        if self.rescore_table:
+            sql, dtype = "SELECT document_id, embedding FROM embeddings", np.float16
+        else:
+            sql, dtype = "SELECT document_id, contents_embedding FROM vec_documents", np.float32
+        for document_id, embedding in self.reader.execute(f"{sql} WHERE document_id > ? ORDER BY document_id", [after_id]):
+            yield document_id, np.frombuffer(embedding, dtype=dtype).astype(np.float32)
+
+    def _rescore(self, query_embedding, document_ids, k: int):
+        """Rank candidates by L2 distance on their full (float16) vectors from the embeddings table"""
+        ids, vectors = [], []
+        for start in range(0, len(document_ids), 500): # stay below SQLite's variable limit
+            chunk = document_ids[start:start + 500]
+            for document_id, embedding in self.reader.execute(
+                f"SELECT document_id, embedding FROM embeddings WHERE document_id IN ({','.join('?' * len(chunk))})",
+                chunk,
+            ):
+                ids.append(document_id)
+                vectors.append(embedding)
+        if not ids:
+            return []
+        matrix = np.frombuffer(b"".join(vectors), dtype=np.float16).reshape(len(ids), -1).astype(np.float32)
+        distances = np.linalg.norm(matrix - np.asarray(query_embedding, dtype=np.float32), axis=1)
+        return [(ids[i], float(distances[i])) for i in np.argsort(distances)[:k]]
+
+    def with_contents(self, ranking):
+        """Turn (document_id, score) pairs into rows of (contents, score, document_id), reading the texts in one query"""
+        contents = self.get_contents([document_id for document_id, _ in ranking])
+        return [(contents[document_id], score, document_id) for document_id, score in ranking if document_id in contents]
+
+    def get_query_ids(self, query_embedding, k:int=5, oversample:int=8):
+        """
+        Vector KNN search. Returns (document_id, distance) pairs, best first, without reading any text
+
+        On a quantized or prefiltered database the coarse vectors (quantized and/or
+        truncated) are scanned for k * oversample candidates, which are then rescored
+        with the full float vectors.
+        """
+        coarse = self._coarse_sql("?1")
+        if self.rescore_table:
+            candidates = [row[0] for row in self.reader.execute(
+                f"SELECT document_id FROM vec_documents WHERE contents_embedding_coarse MATCH {coarse} AND k = ?2",
+                [serialize_float32(query_embedding), k * oversample],
+            )]
+            return self._rescore(query_embedding, candidates, k)
+        if coarse: # databases created with the full vectors in vec_documents
+            return self.reader.execute(
+                f"""
+                WITH coarse AS (
+                  SELECT document_id, contents_embedding FROM vec_documents
+                  WHERE contents_embedding_coarse MATCH {coarse}
+                    AND k = ?2
+                )
+                SELECT document_id, vec_distance_l2(contents_embedding, ?1) AS distance FROM coarse
+                ORDER BY distance
+                LIMIT ?3
+                """,
+                [serialize_float32(query_embedding), k * oversample, k],
+            ).fetchall()
+        return self.reader.execute(
+            f"""
+            SELECT document_id, distance FROM vec_documents
+            WHERE contents_embedding MATCH ?
+              AND k = {k}
+            ORDER BY distance
+            """,
+            [serialize_float32(query_embedding)],
+        ).fetchall()
+
+    def get_query(self, query_embedding, k:int=5, oversample:int=8):
+        """Vector KNN search (see get_query_ids). Returns rows of (contents, distance, document_id)"""
+        return self.with_contents(self.get_query_ids(query_embedding, k=k, oversample=oversample))
+
+    def get_query_lexical_ids(self, query: str, k:int=5):
+        """BM25 full-text search. Returns (document_id, bm25 score) pairs, best first"""
+        match = fts_query(query)
+        if not match:
+            return []
+        return self.reader.execute(
+            """
+            SELECT rowid, bm25(fts_documents) AS score FROM fts_documents
+            WHERE fts_documents MATCH ?
+            ORDER BY score
+            LIMIT ?
+            """,
+            [match, k],
+        ).fetchall()
+
+    def get_query_lexical(self, query: str, k:int=5):
+        """BM25 full-text search. Returns rows of (contents, bm25 score, document_id), best first"""
+        return self.with_contents(self.get_query_lexical_ids(query, k=k))
+
+    def get_query_hybrid(self, query: str, query_embedding=None, k:int=5, candidates:int=20, rrf_k:int=60, oversample:int=8,
+                         store=None, vector_ids=None):
+        """
+        Hybrid search fusing BM25 and vector KNN rankings with reciprocal rank fusion
+
+        Both rankings are fused on ids; only the texts of the k fused results are read.
+
+        Args:
+            query: Query text for the full-text search
+            query_embedding: Query embedding, or None for lexical-only search
+            k: Number of results to return
+            candidates: Number of results taken from each ranking before fusion
+            rrf_k: Reciprocal rank fusion constant
+            oversample: Candidate multiplier for quantized databases (see get_query)
+            store: VectorStore for the vector ranking (default: this database's sqlite-vec table)
+            vector_ids: Vector ranking already computed for query_embedding, as (document_id, distance)
+                pairs (e.g. from a batched store query)
 
-    def get_query(self, query_embedding, k:int=5):
-       results = self.db.execute(
-          f"""
-        SELECT contents, distance FROM vec_documents
-      WHERE contents_embedding MATCH ?
-        AND k = {k}
-      ORDER BY distance
-       """,
-       [serialize_float32(query_embedding)],
-       ).fetchall()
-       return results
+        Returns:
+            Rows of (contents, fused score, document_id), best first
+        """
+        candidates = max(candidates, k)
+        lexical = self.get_query_lexical_ids(query, k=candidates)
+        if query_embedding is None:
+            return self.with_contents(lexical[:k])
+        vector = vector_ids[:candidates] if vector_ids is not None else \
+            (store or self).get_query_ids(query_embedding, k=candidates, oversample=oversample)
+        fused = reciprocal_rank_fusion([[row[0] for row in lexical], [row[0] for row in vector]], rrf_k=rrf_k)
+        return self.with_contents(fused[:k])
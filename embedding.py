@@ -1,17 +1,39 @@
 import os
+import threading
 from typing import List, Union
 import numpy as np
+import models
+from batching import MicroBatcher
+from cache import QueryEmbeddingCache, normalize_text
+from config import CacheConfig, ServingConfig
 
 # Get embedding model type from environment variable (default is sentence-transformers)
 EMBEDDING_MODEL_TYPE = os.getenv("EMBEDDING_MODEL_TYPE", "sentence-transformers")
 EMBEDDING_MODEL_NAME = os.getenv("EMBEDDING_MODEL_NAME", "ruri-v3-310m")
 
+
+
+def _model():
+    """Get the embedding model, loading it on first use"""
+    return models.get("embedding")
+
+
 # For llama-cpp
 if EMBEDDING_MODEL_TYPE == "llama-cpp":
-    from llama_cpp import Llama
-    
-    if EMBEDDING_MODEL_NAME == "bge-m3":
-        embedding_model = Llama.from_pretrained(
+    if EMBEDDING_MODEL_NAME != "bge-m3":
+        raise ValueError(f"Unknown llama-cpp embedding model: {EMBEDDING_MODEL_NAME}")
+
+    # bge-m3 uses no query/document prefixes
+    DOCUMENT_PREFIX = ""
+    QUERY_PREFIX = ""
+
+    # One Llama instance is not thread-safe: concurrent requests take turns embedding
+    _llama_lock = threading.Lock()
+
+    def _load():
+        from llama_cpp import Llama
+
+        return Llama.from_pretrained(
             repo_id="bbvch-ai/bge-m3-GGUF",
             filename="bge-m3-q4_k_m.gguf",
             n_ctx=4096,
@@ -19,21 +41,43 @@ if EMBEDDING_MODEL_TYPE == "llama-cpp":
             verbose=False,
             n_gpu_layers=-1  # Using all GPU. If you don't have gpu, use n_gpu_layers=0.
         )
-    else:
-        raise ValueError(f"Unknown llama-cpp embedding model: {EMBEDDING_MODEL_NAME}")
-    
-    def get_embedding(text: str):
-        """Get embedding function for llama-cpp"""
-        return embedding_model.create_embedding(text)
 
-# For sentence-transformers
-elif EMBEDDING_MODEL_TYPE == "sentence-transformers":
-    from sentence_transformers import SentenceTransformer
-    
+    def _get_embedding(text: str, is_query: bool = False):
+        """Get embedding function for llama-cpp
+
+        Args:
+            text: Text to get embedding for
+            is_query: Unused, bge-m3 uses no query/document prefixes
+        """
+        with _llama_lock:
+            return _model().create_embedding(text)
+
+    def embed_documents(texts: List[str], batch_size: int = 32) -> List[List[float]]:
+        """Get document embeddings in batches for llama-cpp
+
+        Args:
+            texts: Documents to get embeddings for
+            batch_size: Number of documents per embed call
+        """
+        embeddings = []
+        for start in range(0, len(texts), batch_size):
+            with _llama_lock:
+                embeddings.extend(_model().embed(texts[start:start + batch_size]))
+        return embeddings
+
+    def _embed_queries(texts: List[str]) -> List[List[float]]:
+        """Get query embeddings in one call for llama-cpp"""
+        with _llama_lock:
+            return _model().embed(texts)
+
+    def count_tokens(text: str) -> int:
+        """Count tokens with the llama-cpp embedding model's tokenizer"""
+        with _llama_lock:
+            return len(_model().tokenize(text.encode("utf-8"), add_bos=False))
+
+# For sentence-transformers, and int8 ONNX exports with the same interface (onnx_models.py)
+elif EMBEDDING_MODEL_TYPE in ("sentence-transformers", "onnx"):
     if EMBEDDING_MODEL_NAME == "ruri-v3-310m":
-        # Load ruri-v3-310m model
-        embedding_model = SentenceTransformer("cl-nagoya/ruri-v3-310m")
-        
         # ruri-v3-310m requires specific Japanese prefixes for optimal performance
         # These prefixes are part of the model design and must remain in Japanese
         # See: https://huggingface.co/cl-nagoya/ruri-v3-310m
@@ -41,11 +85,21 @@ elif EMBEDDING_MODEL_TYPE == "sentence-transformers":
         QUERY_PREFIX = "検索クエリ: "     # Required Japanese prefix for queries
     else:
         # Other sentence-transformers models
-        embedding_model = SentenceTransformer(EMBEDDING_MODEL_NAME)
         DOCUMENT_PREFIX = ""
         QUERY_PREFIX = ""
+
+    def _load():
+        if EMBEDDING_MODEL_TYPE == "onnx":
+            from onnx_models import OnnxEncoder
+            return OnnxEncoder(EMBEDDING_MODEL_NAME)
+
+        from sentence_transformers import SentenceTransformer
+
+        if EMBEDDING_MODEL_NAME == "ruri-v3-310m":
+            return SentenceTransformer("cl-nagoya/ruri-v3-310m")
+        return SentenceTransformer(EMBEDDING_MODEL_NAME)
     
-    def get_embedding(text: str, is_query: bool = False):
+    def _get_embedding(text: str, is_query: bool = False):
         """Get embedding function for sentence-transformers
         
         Args:
@@ -60,7 +114,7 @@ elif EMBEDDING_MODEL_TYPE == "sentence-transformers":
                 text = DOCUMENT_PREFIX + text
         
         # Get embedding
-        embedding = embedding_model.encode(text, normalize_embeddings=True)
+        embedding = _model().encode(text, normalize_embeddings=True)
         
         # Return in the same format as llama-cpp
         return {
@@ -69,19 +123,129 @@ elif EMBEDDING_MODEL_TYPE == "sentence-transformers":
             }]
         }
 
+    def embed_documents(texts: List[str], batch_size: int = 32) -> List[List[float]]:
+        """Get document embeddings in batches for sentence-transformers
+
+        Args:
+            texts: Documents to get embeddings for
+            batch_size: Number of documents per forward pass
+        """
+        # Add document prefix
+        if EMBEDDING_MODEL_NAME == "ruri-v3-310m":
+            texts = [DOCUMENT_PREFIX + text for text in texts]
+
+        embeddings = _model().encode(texts, batch_size=batch_size, normalize_embeddings=True)
+        return embeddings.tolist()
+
+    def _embed_queries(texts: List[str]) -> List[List[float]]:
+        """Get query embeddings in one forward pass for sentence-transformers"""
+        texts = [QUERY_PREFIX + text for text in texts]
+        return _model().encode(texts, batch_size=len(texts), normalize_embeddings=True).tolist()
+
+    def count_tokens(text: str) -> int:
+        """Count tokens with the sentence-transformers model's tokenizer"""
+        return len(_model().tokenizer(text, add_special_tokens=False)["input_ids"])
+
 else:
     raise ValueError(f"Unknown embedding model type: {EMBEDDING_MODEL_TYPE}")
 
+models.register("embedding", _load)
+
+_query_cache = None
+_init_lock = threading.Lock()
+
+
+def get_query_cache():
+    """Get the query embedding cache, or None if it is disabled (QUERY_CACHE_SIZE=0)"""
+    global _query_cache
+    if _query_cache is None:
+        info = CacheConfig.get_cache_info()
+        if info["query_cache_size"] <= 0:
+            return None
+        with _init_lock:
+            if _query_cache is None:
+                _query_cache = QueryEmbeddingCache(info["query_cache_size"], info["query_cache_path"])
+    return _query_cache
+
+
+_query_batcher = None
+
+
+def get_query_batcher():
+    """Get the micro-batcher for query embeddings, or None if MICRO_BATCH is not enabled"""
+    global _query_batcher
+    if _query_batcher is None:
+        info = ServingConfig.get_serving_info()
+        if not info["micro_batch"]:
+            return None
+        with _init_lock:
+            if _query_batcher is None:
+                _query_batcher = MicroBatcher(
+                    _embed_queries, info["micro_batch_size"], info["micro_batch_wait_ms"], name="query-embedding"
+                )
+    return _query_batcher
+
+
+def _embed_query(text: str) -> List[float]:
+    """Embed one query, batched with concurrent queries when micro-batching is enabled"""
+    batcher = get_query_batcher()
+    if batcher is not None:
+        return batcher(text)
+    return _get_embedding(text, is_query=True)["data"][0]["embedding"]
+
+
+def get_embedding(text: str, is_query: bool = False):
+    """Get embedding of a text
+
+    Query embeddings are served from an LRU cache keyed by model, query prefix and
+    normalized text, so repeated questions are not re-encoded.
+
+    Args:
+        text: Text to get embedding for
+        is_query: True for query, False for document (for ruri-v3-310m)
+    """
+    if not is_query:
+        return _get_embedding(text, is_query)
+
+    cache = get_query_cache()
+    if cache is None:
+        embedding = _embed_query(text)
+    else:
+        # Only the key is normalized: the text is embedded as the uncached and batched paths embed it
+        key = f"{EMBEDDING_MODEL_TYPE}/{EMBEDDING_MODEL_NAME}\n{QUERY_PREFIX}\n{normalize_text(text)}"
+        embedding = cache.get(key)
+        if embedding is None:
+            embedding = _embed_query(text)
+            cache.put(key, embedding)
+    return {
+        "data": [{
+            "embedding": embedding
+        }]
+    }
+
+
+def embed_queries(texts: List[str], batch_size: int = 32) -> List[List[float]]:
+    """Get query embeddings in batches, bypassing the query cache (for evaluation runs)
+
+    Args:
+        texts: Queries to get embeddings for
+        batch_size: Number of queries per model call
+    """
+    embeddings = []
+    for start in range(0, len(texts), batch_size):
+        embeddings.extend(_embed_queries(texts[start:start + batch_size]))
+    return embeddings
+
 
 def get_embedding_dimension():
     """Return the dimension of embedding vectors"""
     if EMBEDDING_MODEL_TYPE == "llama-cpp":
         return 1024  # bge-m3 dimension
-    elif EMBEDDING_MODEL_TYPE == "sentence-transformers":
+    elif EMBEDDING_MODEL_TYPE in ("sentence-transformers", "onnx"):
         if EMBEDDING_MODEL_NAME == "ruri-v3-310m":
             return 768  # ruri-v3-310m dimension is 768
         else:
             # Get dimension from model
-            return embedding_model.get_sentence_embedding_dimension()
+            return _model().get_sentence_embedding_dimension()
     else:
         return 1024  # Default
\ No newline at end of file
@@ -0,0 +1,306 @@
+"""
+Document ingestion pipeline for TinyRAG
+
+With one worker, batches are embedded and written in-process. With more
+workers, batches fan out to embedding worker processes (each loading its own
+model) and the vectors stream back to a single writer process that owns the
+database connection. All queues are bounded so memory stays flat.
+
+Documents are identified by content hash: texts already in the database are
+skipped before embedding, so re-running an ingestion only embeds new texts and
+resumes after the last committed batch if it was interrupted.
+
+Texts longer than the configured chunk size are split into chunks (see
+chunking.py) by whichever process embeds them; chunks are stored as separate
+rows linked to their parent document.
+
+texts can be any iterable, e.g. dataset_texts() reading a Hugging Face
+dataset in chunks: embedding starts with the first batch and peak memory does
+not depend on the corpus size. Repeated texts are dropped with a HashSet of
+8 bytes per document.
+"""
+import os
+import queue
+import multiprocessing as mp
+from typing import Iterable, Iterator, List, Optional, Sequence
+
+import numpy as np
+from tqdm.auto import tqdm
+
+from config import IngestConfig
+from database import Database, content_hash
+
+
+def iter_batches(texts: Iterable[str], batch_size: int) -> Iterator[List[str]]:
+    """Yield lists of at most batch_size texts"""
+    batch = []
+    for text in texts:
+        batch.append(text)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class HashSet:
+    """
+    Set of content_hash() values stored as 64-bit prefixes in a sorted NumPy array
+
+    8 bytes per hash instead of a Python string, so the set of every document
+    seen stays small on large corpora. New hashes wait in a small Python set
+    that is merged into the array every merge_size additions. Two different
+    texts share a prefix with a probability of about n^2 / 2^65.
+    """
+
+    def __init__(self, merge_size: int = 65536):
+        self.merge_size = merge_size
+        self._sorted = np.empty(0, dtype=np.uint64)
+        self._pending = set()
+
+    @staticmethod
+    def _key(h: str) -> int:
+        return int(h[:16], 16)
+
+    def add(self, h: str):
+        self._pending.add(self._key(h))
+        if len(self._pending) >= self.merge_size:
+            self._sorted = np.union1d(self._sorted, np.fromiter(self._pending, dtype=np.uint64, count=len(self._pending)))
+            self._pending.clear()
+
+    def __contains__(self, h: str) -> bool:
+        key = self._key(h)
+        if key in self._pending:
+            return True
+        i = np.searchsorted(self._sorted, np.uint64(key))
+        return bool(i < len(self._sorted) and self._sorted[i] == key)
+
+    def __len__(self) -> int:
+        return len(self._sorted) + len(self._pending)
+
+
+def _new_texts(db: Database, texts: Iterable[str], batch_size: int, progress, seen: HashSet) -> Iterator[str]:
+    """Yield the texts whose contents are not in the database yet and were not seen earlier in texts"""
+    for batch in iter_batches(texts, batch_size):
+        hashes = [content_hash(text) for text in batch]
+        existing = db.existing_hashes(hashes)
+        skipped = 0
+        for text, h in zip(batch, hashes):
+            if h in existing or h in seen:
+                skipped += 1
+            else:
+                yield text
+            seen.add(h)
+        progress.update(skipped)
+
+
+def dataset_texts(path: str, columns: Sequence[str], split: str = "train", limit: int = 0,
+                  streaming: Optional[bool] = None, read_size: int = 1000) -> Iterator[str]:
+    """
+    Yield the texts of some columns of a Hugging Face dataset split, a chunk of rows at a time
+
+    A column may hold a text or a list of {"text": ...} records (e.g. retrieved
+    contexts); empty texts are skipped. Without streaming the split is
+    downloaded once and read from its memory-mapped Arrow cache; with streaming
+    (an IterableDataset) rows are read from the hub files as they arrive.
+
+    Args:
+        path: Dataset name on the hub
+        columns: Columns to read the texts from
+        split: Dataset split
+        limit: Only read the first rows (0 = all)
+        streaming: Use an IterableDataset (default from IngestConfig)
+        read_size: Rows read per chunk
+    """
+    from datasets import load_dataset
+
+    if streaming is None:
+        streaming = IngestConfig.get_ingest_info()["streaming"]
+    ds = load_dataset(path, split=split, streaming=streaming).select_columns(list(columns))
+    if limit:
+        ds = ds.take(limit) if streaming else ds.select(range(limit))
+    for rows in ds.iter(batch_size=read_size):
+        for column in columns:
+            for value in rows[column]:
+                if isinstance(value, str):
+                    if value:
+                        yield value
+                else:
+                    yield from (record["text"] for record in value if record["text"])
+
+
+def _embed_batch(texts: List[str], batch_size: int, chunk_size: int, chunk_overlap: int):
+    """
+    Chunk and embed a batch of texts
+
+    Returns:
+        (contents, embeddings, parents) ready for Database.insert_many
+    """
+    from embedding import count_tokens, embed_documents
+
+    if chunk_size <= 0:
+        return texts, embed_documents(texts, batch_size=batch_size), texts
+
+    from chunking import chunk_text
+
+    contents, parents = [], []
+    for text in texts:
+        for chunk in chunk_text(text, count_tokens, chunk_size, chunk_overlap):
+            contents.append(chunk)
+            parents.append(text)
+    return contents, embed_documents(contents, batch_size=batch_size), parents
+
+
+def _embed_worker(task_queue, result_queue, num_threads: int, batch_size: int, chunk_size: int, chunk_overlap: int):
+    """Embedding worker process: embed batches until a None sentinel arrives"""
+    # Keep workers from oversubscribing the CPU; must be set before torch is imported
+    os.environ.setdefault("OMP_NUM_THREADS", str(num_threads))
+    import models
+    models.warmup(["embedding"])  # each worker loads its own model
+
+    while True:
+        batch = task_queue.get()
+        if batch is None:
+            break
+        result_queue.put((len(batch), _embed_batch(batch, batch_size, chunk_size, chunk_overlap)))
+    result_queue.put(None)
+
+
+def _writer(db_path: str, result_queue, progress_queue, num_workers: int):
+    """Writer process: the only process that writes to the database"""
+    db = Database(db_path)
+    finished = 0
+    while finished < num_workers:
+        item = result_queue.get()
+        if item is None:
+            finished += 1
+            continue
+        num_texts, (contents, embeddings, parents) = item
+        progress_queue.put((num_texts, db.insert_many(contents, embeddings, parents)))
+    progress_queue.put(None)
+
+
+def _check_alive(processes):
+    """Raise if any pipeline process died with an error"""
+    for process in processes:
+        if process.exitcode not in (None, 0):
+            for other in processes:
+                other.terminate()
+            raise RuntimeError(f"Ingestion process {process.name} exited with code {process.exitcode}")
+
+
+def ingest(
+    db_path: str,
+    texts: Iterable[str],
+    num_workers: Optional[int] = None,
+    batch_size: Optional[int] = None,
+    queue_size: Optional[int] = None,
+    total: Optional[int] = None,
+    prune: Optional[bool] = None
+) -> dict:
+    """
+    Embed texts and insert them into an existing database
+
+    Args:
+        db_path: Path of the database file (create_db must already have been called)
+        texts: Documents to ingest
+        num_workers: Embedding worker processes, 1 embeds in-process (default from IngestConfig)
+        batch_size: Documents per batch and per transaction (default from IngestConfig)
+        queue_size: Max batches buffered in each queue (default from IngestConfig)
+        total: Number of documents, for the progress bar
+        prune: Also delete documents in the database that are not in texts (default from IngestConfig)
+
+    Returns:
+        Dictionary with the source 'documents' embedded, the 'skipped' ones (already
+        in the database or repeated) and the 'chunks' (rows) inserted
+    """
+    info = IngestConfig.get_ingest_info()
+    num_workers = num_workers or info["workers"]
+    batch_size = batch_size or info["batch_size"]
+    queue_size = queue_size or info["queue_size"]
+    prune = info["prune"] if prune is None else prune
+    chunk_size, chunk_overlap = info["chunk_size"], info["chunk_overlap"]
+    progress = tqdm(total=total, unit="doc")
+    db = Database(db_path)
+    seen = HashSet() # every text of this run: repeats are skipped, and pruning keeps them
+    new_texts = _new_texts(db, texts, batch_size, progress, seen)
+
+    if num_workers <= 1:
+        count = documents = 0
+        for batch in iter_batches(new_texts, batch_size):
+            count += db.insert_many(*_embed_batch(batch, batch_size, chunk_size, chunk_overlap))
+            documents += len(batch)
+            progress.update(len(batch))
+        progress.close()
+        if prune:
+            print(f"Pruned {db.prune(seen)} documents")
+        return {"documents": documents, "skipped": progress.n - documents, "chunks": count}
+
+    # spawn so every worker starts clean and loads its own model
+    ctx = mp.get_context("spawn")
+    task_queue = ctx.Queue(maxsize=queue_size)
+    result_queue = ctx.Queue(maxsize=queue_size)
+    progress_queue = ctx.Queue()
+    num_threads = max(1, (os.cpu_count() or 1) // num_workers)
+
+    workers = [
+        ctx.Process(target=_embed_worker, args=(task_queue, result_queue, num_threads, batch_size, chunk_size, chunk_overlap),
+                    name=f"embed-{i}", daemon=True)
+        for i in range(num_workers)
+    ]
+    writer = ctx.Process(target=_writer, args=(db_path, result_queue, progress_queue, num_workers), name="writer", daemon=True)
+    processes = workers + [writer]
+    for process in processes:
+        process.start()
+
+    count = documents = 0
+
+    def drain_progress():
+        nonlocal count, documents
+        while True:
+            try:
+                item = progress_queue.get_nowait()
+            except queue.Empty:
+                return
+            if item is not None:
+                processed, inserted = item
+                count += inserted
+                documents += processed
+                progress.update(processed)
+
+    def put(item):
+        # put() blocks while the task queue is full; keep checking the pipeline is healthy
+        while True:
+            try:
+                task_queue.put(item, timeout=1)
+                return
+            except queue.Full:
+                _check_alive(processes)
+                drain_progress()
+
+    for batch in iter_batches(new_texts, batch_size):
+        put(batch)
+        drain_progress()
+    for _ in workers:
+        put(None)
+
+    # Wait for the writer to commit everything
+    while True:
+        try:
+            item = progress_queue.get(timeout=1)
+        except queue.Empty:
+            _check_alive(processes)
+            continue
+        if item is None:
+            break
+        processed, inserted = item
+        count += inserted
+        documents += processed
+        progress.update(processed)
+
+    for process in processes:
+        process.join()
+    progress.close()
+    if prune:
+        print(f"Pruned {db.prune(seen)} documents")
+    return {"documents": documents, "skipped": progress.n - documents, "chunks": count}
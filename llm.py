@@ -1,14 +1,101 @@
+import threading
 from typing import List
-from llama_cpp import Dict, Llama
+import models
+from config import CacheConfig, ServingConfig
+
+# One Llama instance is not thread-safe: concurrent requests take turns generating
+_llm_lock = threading.Lock()
+_pool = None
+_pool_lock = threading.Lock()
 
 # Can change the model by huggingface hub
-llm_model = Llama.from_pretrained(
-    repo_id="bartowski/Llama-3.2-1B-Instruct-GGUF",
-    filename="Llama-3.2-1B-Instruct-Q4_K_S.gguf",
-    n_ctx=16384,
-    verbose=False,
-    n_gpu_layers=-1 # Using all GPU. If you don't have gpu, use n_gpu_layers=0.
-)
+LLM_REPO_ID = "bartowski/Llama-3.2-1B-Instruct-GGUF"
+LLM_FILENAME = "Llama-3.2-1B-Instruct-Q4_K_S.gguf"
+LLM_N_CTX = 16384
+
+
+def _load():
+    from llama_cpp import Llama
+
+    llm = Llama.from_pretrained(
+        repo_id=LLM_REPO_ID,
+        filename=LLM_FILENAME,
+        n_ctx=LLM_N_CTX,
+        verbose=False,
+        n_gpu_layers=-1 # Using all GPU. If you don't have gpu, use n_gpu_layers=0.
+    )
+    cache = _prompt_cache()
+    if cache is not None:
+        llm.set_cache(cache)
+    return llm
+
+
+def _prompt_cache():
+    """
+    Create the KV-state cache of the LLM, or None if LLM_PROMPT_CACHE is not set
+
+    llama-cpp saves the model state after each completion, keyed by the prompt
+    and answer tokens, and restores the state with the longest matching prefix
+    before the next one. With the cache set, the query is sent as its own
+    message before the RAG prompt (see prompt.pack_prompt), so a chat's next
+    turn repeats the previous prompt up to the last query; the documents and
+    the last answer are evaluated again. With "ram", each LLM_WORKERS process
+    has its own cache of LLM_PROMPT_CACHE_MB.
+    """
+    info = CacheConfig.get_cache_info()
+    capacity_bytes = info["llm_prompt_cache_mb"] * 2**20
+    if info["llm_prompt_cache"] == "ram":
+        from llama_cpp import LlamaRAMCache
+        return LlamaRAMCache(capacity_bytes=capacity_bytes)
+    if info["llm_prompt_cache"] == "disk":
+        from llama_cpp import LlamaDiskCache
+        return LlamaDiskCache(cache_dir=info["llm_prompt_cache_path"], capacity_bytes=capacity_bytes)
+    if info["llm_prompt_cache"]:
+        raise ValueError(f"Invalid LLM_PROMPT_CACHE: {info['llm_prompt_cache']}. Available: ['ram', 'disk']")
+    return None
+
+
+def _load_tokenizer():
+    from llama_cpp import Llama
+
+    # Vocabulary only: counts tokens in processes that do not run the model (LLM_WORKERS > 0)
+    return Llama.from_pretrained(repo_id=LLM_REPO_ID, filename=LLM_FILENAME, vocab_only=True, verbose=False)
+
+
+models.register("llm", _load) # loaded on first use
+models.register("llm_tokenizer", _load_tokenizer)
+
+
+def count_llm_tokens(text: str) -> int:
+    """Count the LLM tokens of a text"""
+    if ServingConfig.get_serving_info()["llm_workers"] > 0:
+        tokenizer = models.get("llm_tokenizer")
+    else:
+        tokenizer = models.get("llm")
+    return len(tokenizer.tokenize(text.encode("utf-8"), add_bos=False, special=True))
+
+
+def get_llm_pool():
+    """
+    Start the LLM worker pool on first use, or return None if LLM_WORKERS is 0 (in-process model)
+
+    A pool closed after a worker died is replaced by a new one, so only the
+    requests running at the time fail.
+    """
+    global _pool
+    info = ServingConfig.get_serving_info()
+    if info["llm_workers"] <= 0:
+        return None
+    with _pool_lock:
+        if _pool is None or _pool.closed:
+            from llm_pool import LLMPool
+            _pool = LLMPool(
+                num_workers=info["llm_workers"],
+                max_queue=info["llm_queue_size"],
+                queue_timeout=info["llm_queue_timeout"],
+                num_threads=info["llm_threads"]
+            ).start()
+    return _pool
 
 
 def get_llm_output(message, stream=False):
@@ -23,7 +110,18 @@ def get_llm_output(message, stream=False):
         If stream=False: Complete response dictionary
         If stream=True: Generator yielding response chunks
     """
-    return llm_model.create_chat_completion(messages=message, stream=stream)
+    pool = get_llm_pool()
+    if pool is not None:
+        return pool.chat(message, stream=True) if stream else list(pool.chat(message, stream=False))[0]
+    if stream:
+        return _locked_stream(message)
+    with _llm_lock:
+        return models.get("llm").create_chat_completion(messages=message, stream=False)
+
+
+def _locked_stream(message):
+    with _llm_lock:
+        yield from models.get("llm").create_chat_completion(messages=message, stream=True)
 
 
 def get_llm_stream(message):
@@ -36,7 +134,9 @@ def get_llm_stream(message):
     Yields:
         String chunks of the response content
     """
-    for chunk in llm_model.create_chat_completion(messages=message, stream=True):
+    pool = get_llm_pool()
+    # Closing this generator early (client disconnected) cancels the request on its worker
+    chunks = pool.chat(message, stream=True) if pool is not None else _locked_stream(message)
+    for chunk in chunks:
         if chunk['choices'][0]['delta'].get('content'):
             yield chunk['choices'][0]['delta']['content']
-
@@ -0,0 +1,251 @@
+"""
+Out-of-process LLM worker pool for TinyRAG
+
+Each worker process loads its own Llama model and takes chat requests from
+one shared queue, so several answers are generated in parallel and no Llama
+instance is ever shared between threads. Streamed chunks are relayed back to
+the calling thread by a dispatcher thread.
+
+Admission control: at most num_workers + max_queue requests are in flight;
+a caller waits up to queue_timeout seconds for a slot, then gets
+QueueFullError. Closing a stream early (e.g. Gradio dropping the generator when
+the client disconnects) cancels the request, and its worker moves on to the
+next one after the current chunk.
+
+If a worker dies the pool closes: waiting and later requests fail at once
+with PoolClosedError, and llm.get_llm_pool() starts a new pool.
+"""
+import itertools
+import os
+import queue
+import threading
+import time
+import traceback
+import multiprocessing as mp
+from typing import Callable, Dict, Iterator, List, Optional
+
+
+class QueueFullError(RuntimeError):
+    """Raised when the LLM request queue stays full for longer than queue_timeout"""
+
+
+class PoolClosedError(RuntimeError):
+    """Raised for requests to a closed pool (closed explicitly or after a worker died)"""
+
+
+def _llm_worker(index: int, request_queue, result_queue, control_queue, num_threads: int,
+                initializer: Optional[Callable[[], None]]):
+    """Load a model, then answer (request_id, messages, stream) requests until None is received"""
+    if num_threads:
+        os.environ["OMP_NUM_THREADS"] = str(num_threads)
+    try:
+        import models
+        if initializer is not None:
+            initializer()
+        start = time.perf_counter()
+        llm = models.get("llm")
+    except Exception:
+        result_queue.put((None, "error", traceback.format_exc()))
+        return
+    result_queue.put((None, "ready", (index, time.perf_counter() - start)))
+
+    cancelled = set()
+    while True:
+        request = request_queue.get()
+        if request is None:
+            break
+        request_id, messages, stream = request
+        result_queue.put((request_id, "start", index))
+        try:
+            if not stream:
+                result_queue.put((request_id, "chunk", llm.create_chat_completion(messages=messages, stream=False)))
+            else:
+                for chunk in llm.create_chat_completion(messages=messages, stream=True):
+                    while True: # pick up cancellations sent since the last chunk
+                        try:
+                            cancelled.add(control_queue.get_nowait())
+                        except queue.Empty:
+                            break
+                    if request_id in cancelled:
+                        break
+                    result_queue.put((request_id, "chunk", chunk))
+            result_queue.put((request_id, "done", None))
+        except Exception:
+            result_queue.put((request_id, "error", traceback.format_exc()))
+        cancelled.clear() # ids are never reused
+
+
+class LLMPool:
+    """Pool of LLM worker processes behind a bounded request queue"""
+
+    def __init__(self, num_workers: int = 2, max_queue: int = 8, queue_timeout: float = 30, num_threads: int = 0,
+                 initializer: Optional[Callable[[], None]] = None):
+        """
+        Args:
+            num_workers: Worker processes, each with its own model
+            max_queue: Requests allowed to wait for a free worker
+            queue_timeout: Seconds a caller waits for a slot before QueueFullError
+            num_threads: OMP threads per worker (0 = library default)
+            initializer: Picklable function each worker calls before loading the model
+                (e.g. stub_models.install)
+        """
+        self.num_workers = num_workers
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.num_threads = num_threads
+        self.initializer = initializer
+        self.closed = False
+        self.rejected = 0
+        self.cancelled = 0
+        self._slots = threading.BoundedSemaphore(num_workers + max_queue)
+        self._ids = itertools.count()
+        self._streams: Dict[int, queue.Queue] = {}
+        self._active = set() # request ids queued or running
+        self._running: Dict[int, int] = {} # request id -> worker index
+        self._pending_cancel = set() # cancelled before a worker picked them up
+        self._lock = threading.Lock()
+        self._processes = []
+
+    def start(self):
+        """Start the workers and wait until every one has loaded its model"""
+        # spawn so every worker starts clean and loads its own model
+        ctx = mp.get_context("spawn")
+        self._requests = ctx.Queue()
+        self._results = ctx.Queue()
+        self._controls = [ctx.Queue() for _ in range(self.num_workers)]
+        self._processes = [
+            ctx.Process(target=_llm_worker, args=(i, self._requests, self._results, self._controls[i], self.num_threads,
+                                                     self.initializer),
+                        name=f"llm-{i}", daemon=True)
+            for i in range(self.num_workers)
+        ]
+        for process in self._processes:
+            process.start()
+
+        ready = 0
+        while ready < self.num_workers:
+            try:
+                _, kind, payload = self._results.get(timeout=1)
+            except queue.Empty:
+                self._check_alive()
+                continue
+            if kind == "error":
+                self.close()
+                raise RuntimeError(f"LLM worker failed to load the model:\n{payload}")
+            index, seconds = payload
+            print(f"Loaded llm in worker {index} in {seconds:.1f}s")
+            ready += 1
+
+        threading.Thread(target=self._dispatch, name="llm-dispatcher", daemon=True).start()
+        return self
+
+    def _dispatch(self):
+        """Route worker messages to the waiting callers"""
+        while True:
+            request_id, kind, payload = self._results.get()
+            if kind == "closed":
+                return
+            with self._lock:
+                if kind == "start":
+                    self._running[request_id] = payload
+                    if request_id in self._pending_cancel:
+                        self._pending_cancel.discard(request_id)
+                        self._controls[payload].put(request_id)
+                    continue
+                if kind in ("done", "error"):
+                    self._active.discard(request_id)
+                    self._running.pop(request_id, None)
+                    self._slots.release()
+                stream = self._streams.get(request_id)
+            if stream is not None:
+                stream.put((kind, payload))
+
+    def _check_alive(self):
+        """Raise if the pool is closed; close it and raise if any worker died"""
+        if self.closed:
+            raise PoolClosedError("LLM pool is closed")
+        for process in self._processes:
+            if process.exitcode is not None:
+                self.close()
+                raise PoolClosedError(f"LLM worker {process.name} exited with code {process.exitcode}")
+
+    def chat(self, messages: List[dict], stream: bool = True) -> Iterator[dict]:
+        """
+        Run a chat completion on a worker
+
+        Args:
+            messages: List of message dictionaries with 'role' and 'content'
+            stream: If True, yields the streamed chunks; if False, yields the complete response once
+
+        Raises:
+            QueueFullError: If no slot frees up within queue_timeout seconds
+            PoolClosedError: If the pool is closed or a worker dies
+        """
+        self._check_alive()
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            self.rejected += 1
+            raise QueueFullError(f"LLM queue is full ({self.num_workers} running, {self.max_queue} waiting)")
+
+        request_id = next(self._ids)
+        results = queue.Queue()
+        with self._lock:
+            self._active.add(request_id)
+            self._streams[request_id] = results
+        self._requests.put((request_id, messages, stream))
+        finished = False
+        try:
+            while True:
+                try:
+                    kind, payload = results.get(timeout=1)
+                except queue.Empty:
+                    self._check_alive()
+                    continue
+                if kind == "chunk":
+                    yield payload
+                elif kind == "closed":
+                    finished = True
+                    raise PoolClosedError(payload)
+                elif kind == "error":
+                    finished = True
+                    raise RuntimeError(f"LLM worker failed:\n{payload}")
+                else:
+                    finished = True
+                    return
+        finally:
+            with self._lock:
+                self._streams.pop(request_id, None)
+                if not finished and request_id in self._active:
+                    self._cancel(request_id)
+
+    def _cancel(self, request_id: int):
+        """Stop generating a request (called with self._lock held)"""
+        self.cancelled += 1
+        worker = self._running.get(request_id)
+        if worker is None:
+            self._pending_cancel.add(request_id) # cancelled as soon as a worker picks it up
+        else:
+            self._controls[worker].put(request_id)
+
+    def close(self):
+        """Stop every worker and fail the requests still waiting for an answer"""
+        with self._lock:
+            if self.closed:
+                return
+            self.closed = True
+            streams = list(self._streams.values())
+        for process in self._processes:
+            if process.is_alive():
+                process.terminate()
+        if self._processes: # started
+            self._results.put((None, "closed", None)) # stops the dispatcher
+        for stream in streams:
+            stream.put(("closed", "LLM pool closed while the request was running"))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "workers": self.num_workers,
+                "running": len(self._running),
+                "rejected": self.rejected,
+                "cancelled": self.cancelled
+            }
@@ -0,0 +1,74 @@
+"""
+Lazy model registry for TinyRAG
+
+Each model module (embedding.py, llm.py, reranker.py) registers a loader under
+its own module name instead of loading the model at import time. The model is
+loaded on first use, once, even when several threads ask for it at the same
+time, so entry points only pay for the models they actually use.
+"""
+import importlib
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Optional
+
+_loaders: Dict[str, Callable[[], Any]] = {}
+_models: Dict[str, Any] = {}
+_locks: Dict[str, threading.Lock] = {}
+_registry_lock = threading.Lock()
+
+
+def register(name: str, loader: Callable[[], Any]):
+    """Register a loader for a model; nothing is loaded until get() is called"""
+    with _registry_lock:
+        _loaders[name] = loader
+        _locks.setdefault(name, threading.Lock())
+
+
+def get(name: str) -> Any:
+    """
+    Get a model, loading it on first use (thread-safe)
+
+    A model that has not been registered yet is registered by importing the
+    module of the same name, e.g. get("llm") imports llm.py.
+    """
+    model = _models.get(name)
+    if model is not None:
+        return model
+
+    if name not in _loaders:
+        importlib.import_module(name)
+        if name not in _loaders:
+            raise KeyError(f"Unknown model: {name}. Registered: {list(_loaders)}")
+
+    with _locks[name]:
+        model = _models.get(name)
+        if model is None: # another thread may have loaded it while we waited
+            model = _loaders[name]()
+            _models[name] = model
+    return model
+
+
+def is_loaded(name: str) -> bool:
+    """Return True if the model has already been loaded"""
+    return name in _models
+
+
+def warmup(names: Optional[Iterable[str]] = None) -> Dict[str, float]:
+    """
+    Load models now instead of on first use
+
+    Args:
+        names: Models to load (default: every registered model)
+
+    Returns:
+        Load time in seconds of each model that was loaded by this call
+    """
+    timings = {}
+    for name in list(names if names is not None else _loaders):
+        if is_loaded(name):
+            continue
+        start = time.perf_counter()
+        get(name)
+        timings[name] = time.perf_counter() - start
+        print(f"Loaded {name} in {timings[name]:.1f}s")
+    return timings
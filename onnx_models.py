@@ -0,0 +1,226 @@
+"""
+ONNX Runtime backends for the embedding model and the reranker
+
+For CPU-only nodes: the models are exported to ONNX and quantized to int8
+(dynamic quantization of the weights), then run with onnxruntime instead of
+PyTorch or llama-cpp. The classes have the same interface as the models they
+replace, so embedding.py and reranker.py use them unchanged:
+
+- OnnxEncoder: SentenceTransformer-like (encode, tokenizer,
+  get_sentence_embedding_dimension) with the pooling of the original model,
+  used by EMBEDDING_MODEL_TYPE=onnx
+- OnnxReranker: embed(["query</s><s>document", ...]) -> [[score], ...] like
+  the llama-cpp reranker, used by RERANK_BACKEND=onnx
+
+Exported models live in ONNX_MODEL_DIR and are exported on first use (needs
+`pip install optimum[onnxruntime]`; running them only needs onnxruntime and
+transformers). Export ahead of time, and check that int8 embeddings are
+close enough to the original model to keep using an existing database:
+
+    python onnx_models.py --model ruri-v3-310m --check
+    python onnx_models.py --reranker
+"""
+import argparse
+import os
+import threading
+from typing import List
+
+import numpy as np
+
+from config import OnnxConfig
+
+# name -> (Hugging Face repo, pooling, dimension)
+EMBEDDING_MODELS = {
+    "ruri-v3-310m": ("cl-nagoya/ruri-v3-310m", "mean", 768),
+    "bge-m3": ("BAAI/bge-m3", "cls", 1024),
+}
+RERANKER_MODEL = "BAAI/bge-reranker-v2-m3"
+QUANTIZED_FILE = "model_quantized.onnx"
+# dynamic int8 quantization settings of optimum's AutoQuantizationConfig
+ARCHITECTURES = ["avx512_vnni", "avx2", "arm64"]
+
+
+def model_path(repo_id: str) -> str:
+    """Directory of the int8 export of a model"""
+    return os.path.join(OnnxConfig.get_onnx_info()["model_dir"], repo_id.split("/")[-1] + "-int8")
+
+
+def export(repo_id: str, task: str = "feature-extraction", architecture: str = "avx512_vnni") -> str:
+    """
+    Export a Hugging Face model to ONNX and quantize it to int8
+
+    Args:
+        repo_id: Hugging Face model id
+        task: "feature-extraction" (embedding model) or "text-classification" (reranker)
+        architecture: CPU the quantized operators are chosen for (see ARCHITECTURES)
+
+    Returns:
+        Directory of the quantized model and its tokenizer
+    """
+    from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTModelForSequenceClassification, ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+    from transformers import AutoTokenizer
+
+    if architecture not in ARCHITECTURES:
+        raise ValueError(f"Invalid architecture: {architecture}. Available: {ARCHITECTURES}")
+    output = model_path(repo_id)
+    model_class = ORTModelForFeatureExtraction if task == "feature-extraction" else ORTModelForSequenceClassification
+    model = model_class.from_pretrained(repo_id, export=True)
+    model.save_pretrained(output + ".fp32")
+    AutoTokenizer.from_pretrained(repo_id).save_pretrained(output)
+    quantization = getattr(AutoQuantizationConfig, architecture)(is_static=False, per_channel=True)
+    ORTQuantizer.from_pretrained(output + ".fp32").quantize(save_dir=output, quantization_config=quantization)
+    return output
+
+
+def _session(path: str):
+    import onnxruntime as ort
+
+    info = OnnxConfig.get_onnx_info()
+    # ONNX_THREADS, or the share of the cores given to an ingest worker (OMP_NUM_THREADS)
+    threads = info["threads"] or int(os.getenv("OMP_NUM_THREADS", "0"))
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    options.intra_op_num_threads = threads # 0 = one per physical core
+    options.inter_op_num_threads = 1
+    return ort.InferenceSession(os.path.join(path, QUANTIZED_FILE), options, providers=["CPUExecutionProvider"])
+
+
+def _export_if_missing(repo_id: str, task: str) -> str:
+    path = model_path(repo_id)
+    if not os.path.exists(os.path.join(path, QUANTIZED_FILE)):
+        print(f"Exporting {repo_id} to {path} (int8 ONNX)")
+        export(repo_id, task)
+    return path
+
+
+class _OnnxModel:
+    """
+    Tokenizer and inference session of an exported model
+
+    The session can be run from several threads at once, but a fast tokenizer
+    cannot ("Already borrowed"), so tokenization takes turns.
+    """
+
+    def __init__(self, path: str):
+        from transformers import AutoTokenizer
+
+        self._tokenizer = AutoTokenizer.from_pretrained(path)
+        self._tokenizer_lock = threading.Lock()
+        self.session = _session(path)
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        # ONNX_MAX_LENGTH, or the model's own limit (some tokenizers report a huge placeholder)
+        self.max_length = OnnxConfig.get_onnx_info()["max_length"] or min(self._tokenizer.model_max_length, 8192)
+
+    def tokenizer(self, *args, **kwargs):
+        """Call the Hugging Face tokenizer (SentenceTransformer's tokenizer attribute), one thread at a time"""
+        with self._tokenizer_lock:
+            return self._tokenizer(*args, **kwargs)
+
+    def _run(self, *texts):
+        """Tokenize (pairs if two lists are given) and return the first output of the model"""
+        encoded = self.tokenizer(*texts, padding=True, truncation=True, max_length=self.max_length, return_tensors="np")
+        feed = {name: value.astype(np.int64) for name, value in encoded.items() if name in self.input_names}
+        return self.session.run(None, feed)[0], encoded["attention_mask"]
+
+    @staticmethod
+    def _batches(lengths: List[int], batch_size: int):
+        """Indices of each batch, texts of similar length together so little padding is computed"""
+        order = np.argsort(lengths)[::-1]
+        for start in range(0, len(order), batch_size):
+            yield order[start:start + batch_size]
+
+
+class OnnxEncoder(_OnnxModel):
+    """int8 ONNX embedding model with the interface of SentenceTransformer"""
+
+    def __init__(self, name: str):
+        if name not in EMBEDDING_MODELS:
+            raise ValueError(f"Unknown ONNX embedding model: {name}. Available: {list(EMBEDDING_MODELS)}")
+        repo_id, self.pooling, self.dim = EMBEDDING_MODELS[name]
+        super().__init__(_export_if_missing(repo_id, "feature-extraction"))
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dim
+
+    def encode(self, texts, batch_size: int = 32, normalize_embeddings: bool = True, **kwargs):
+        """Embed a text (returns a vector) or a list of texts (returns a matrix)"""
+        single = isinstance(texts, str)
+        if single:
+            texts = [texts]
+        embeddings = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for batch in self._batches([len(text) for text in texts], batch_size):
+            hidden, mask = self._run([texts[i] for i in batch])
+            if self.pooling == "cls":
+                embeddings[batch] = hidden[:, 0]
+            else: # mean of the non-padding tokens
+                mask = mask[:, :, None].astype(np.float32)
+                embeddings[batch] = (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+        if normalize_embeddings:
+            embeddings /= np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+        return embeddings[0] if single else embeddings
+
+
+class OnnxReranker(_OnnxModel):
+    """int8 ONNX cross-encoder with the interface of the llama-cpp reranker"""
+
+    def __init__(self):
+        super().__init__(_export_if_missing(RERANKER_MODEL, "text-classification"))
+        self.batch_size = OnnxConfig.get_onnx_info()["batch_size"]
+
+    def embed(self, inputs: List[str]) -> List[List[float]]:
+        """Score "query</s><s>document" inputs; returns the relevance logit of each as [[score], ...]"""
+        pairs = [text.partition("</s><s>") for text in inputs]
+        scores = [None] * len(pairs)
+        for batch in self._batches([len(text) for text in inputs], self.batch_size):
+            logits, _ = self._run([pairs[i][0] for i in batch], [pairs[i][2] for i in batch])
+            for i, logit in zip(batch, logits[:, 0]):
+                scores[i] = [float(logit)]
+        return scores
+
+
+# Sentences in the languages of the demo databases, for --check
+CHECK_TEXTS = [
+    "検索クエリ: 日本で一番高い山は何ですか？",
+    "検索文書: 富士山は日本で最も高い山であり、標高は3776メートルである。",
+    "ผู้ให้เช่าต้องส่งมอบทรัพย์สินที่เช่าในสภาพที่ซ่อมแซมดีแล้ว",
+    "การจดทะเบียนสมรสจะทำได้เฉพาะเมื่อชายและหญิงมีอายุสิบเจ็ดปีบริบูรณ์แล้ว",
+    "Retrieval-augmented generation grounds the answers of a language model in retrieved documents.",
+    "The court dismissed the appeal because it was filed after the deadline.",
+]
+
+
+def check(name: str, texts: List[str]) -> dict:
+    """Cosine similarity between the int8 ONNX embeddings and the original sentence-transformers model"""
+    from sentence_transformers import SentenceTransformer
+
+    onnx = OnnxEncoder(name).encode(texts)
+    reference = SentenceTransformer(EMBEDDING_MODELS[name][0]).encode(texts, normalize_embeddings=True)
+    cosine = (onnx * reference).sum(axis=1)
+    return {"texts": len(texts), "min_cosine": float(cosine.min()), "mean_cosine": float(cosine.mean())}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", choices=list(EMBEDDING_MODELS), help="embedding model to export")
+    parser.add_argument("--reranker", action="store_true", help=f"export the reranker ({RERANKER_MODEL})")
+    parser.add_argument("--architecture", choices=ARCHITECTURES, default="avx512_vnni",
+                        help="CPU to quantize for (avx2 for older x86, arm64 for ARM)")
+    parser.add_argument("--check", action="store_true", help="compare the embeddings with the original model")
+    parser.add_argument("--check-file", help="text file with one sentence per line to compare on")
+    args = parser.parse_args()
+
+    if args.model:
+        print("Exported", export(EMBEDDING_MODELS[args.model][0], "feature-extraction", args.architecture))
+        if args.check:
+            texts = CHECK_TEXTS
+            if args.check_file:
+                with open(args.check_file, encoding="utf-8") as f:
+                    texts = [line.strip() for line in f if line.strip()]
+            print(check(args.model, texts))
+    if args.reranker:
+        print("Exported", export(RERANKER_MODEL, "text-classification", args.architecture))
+
+
+if __name__ == "__main__":
+    main()
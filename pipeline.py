@@ -0,0 +1,232 @@
+"""
+Asyncio RAG pipeline for TinyRAG
+
+RAGPipeline.answer(query, history) is an async generator of events: the
+events of streaming.py (("status", text), ("delta", text),
+("references", text), ("error", text)) plus ("stage", name) when a stage
+starts (embed, retrieve, rerank, prompt, generate).
+
+Every blocking call runs in an executor, so the event loop keeps serving
+other requests: while one answer is generating, the next request is already
+embedding, retrieving and reranking. Embedding, retrieval, cache lookups,
+reranking and prompt packing share a thread pool of PIPELINE_WORKERS
+threads; each answer stream gets its own thread from a second pool, so a long
+generation never holds up the retrieval of other requests.
+
+At most SERVING_CONCURRENCY answers run at the same time, whether they come
+from Gradio or the SSE endpoint; further requests wait for a free slot.
+
+Each stage can be given a timeout (PIPELINE_*_TIMEOUT). A stage that times
+out ends the answer with a "timeout_error" event. Cancelling the task that
+iterates answer() (or closing the generator, as Gradio and the SSE endpoint do
+when the client goes away) stops the LLM stream after its next delta, which
+releases the in-process model or cancels the LLM_WORKERS request. A stage
+already running in the thread pool cannot be interrupted; its result is
+discarded.
+"""
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import aclosing
+from typing import AsyncIterator, Dict, List, Optional
+
+from cache import SemanticCache
+from config import LanguageConfig, RetrievalConfig, ServingConfig
+from database import Database
+from llm import get_llm_stream
+from llm_pool import QueueFullError
+from prompt import build_rag_prompt
+from retrieval import embed_query, rerank, retrieve
+from streaming import Event, coalesce
+from tracing import start_trace
+
+# Status messages shown while each stage runs (the apps pass their own language)
+DEFAULT_STATUS = {
+    "retrieve": "Searching...",
+    "rerank": "Ranking relevant documents...",
+    "generate": "Generating answer..."
+}
+
+
+class RAGPipeline:
+    """Answer questions over a document database, one async event stream per request"""
+
+    def __init__(self, db: Database, store=None, semantic_cache: Optional[SemanticCache] = None,
+                 language: Optional[str] = None, status: Optional[Dict[str, str]] = None):
+        """
+        Args:
+            db: Database to search
+            store: VectorStore for vector search (default: the database's sqlite-vec table)
+            semantic_cache: Cache of final answers, or None
+            language: Language of the prompt and error messages (default: LanguageConfig default)
+            status: Status message of the "retrieve", "rerank" and "generate" stages
+        """
+        info = ServingConfig.get_serving_info()
+        self.db = db
+        self.store = store
+        self.semantic_cache = semantic_cache
+        self.language = language
+        self.status = {**DEFAULT_STATUS, **(status or {})}
+        self.timeouts = {stage: seconds or None for stage, seconds in info["stage_timeouts"].items()}
+        self.coalescing = {"interval_ms": info["stream_interval_ms"], "max_bytes": info["stream_max_bytes"]}
+        self._executor = ThreadPoolExecutor(info["pipeline_workers"], thread_name_prefix="pipeline")
+        # Admission control shared by every caller (Gradio limits its own queue the same way, the SSE API does not)
+        self._slots = asyncio.Semaphore(max(info["concurrency"], 1))
+        # Answer streams mostly wait for tokens: one thread each, for every request admitted, and with LLM_WORKERS
+        # for every request the pool runs or queues, so no stream waits behind another one's thread
+        streams = max(info["concurrency"], 1)
+        if info["llm_workers"] > 0:
+            streams = max(streams, info["llm_workers"] + info["llm_queue_size"])
+        self._stream_executor = ThreadPoolExecutor(streams, thread_name_prefix="pipeline-llm")
+
+    async def _run(self, stage: str, fn, *args, **kwargs):
+        """Run a blocking call in the thread pool, within the stage's timeout"""
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._executor, functools.partial(fn, *args, **kwargs))
+        return await asyncio.wait_for(future, self.timeouts.get(stage))
+
+    async def _generate(self, llm_messages, trace) -> AsyncIterator[str]:
+        """Stream the (coalesced) answer deltas of the LLM, read on a thread of the stream pool"""
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        cancelled = threading.Event()
+
+        def put(item):
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+            except RuntimeError: # the event loop is closed: nobody is listening any more
+                pass
+
+        def pump():
+            deltas = coalesce(trace.stream("llm", get_llm_stream(llm_messages)), **self.coalescing)
+            try:
+                for delta in deltas:
+                    if cancelled.is_set():
+                        break
+                    put(("delta", delta))
+            except BaseException as e:
+                put(("exception", e))
+            else:
+                put(("end", None))
+            finally:
+                deltas.close() # releases the model lock or cancels the worker pool request
+
+        loop.run_in_executor(self._stream_executor, pump)
+        timeout = self.timeouts.get("llm")
+        deadline = loop.time() + timeout if timeout else None
+        try:
+            while True:
+                remaining = deadline - loop.time() if deadline else None
+                kind, value = await asyncio.wait_for(queue.get(), remaining)
+                if kind == "end":
+                    return
+                if kind == "exception":
+                    raise value
+                yield value
+        finally:
+            cancelled.set()
+
+    async def answer(self, query: str, history: Optional[List[dict]] = None, k: int = 5,
+                     include_prompt: bool = False) -> AsyncIterator[Event]:
+        """
+        Answer a query as a stream of events, once one of the SERVING_CONCURRENCY slots is free
+
+        Args:
+            query: User query string
+            history: Previous messages (dicts with 'role' and 'content')
+            k: Number of documents to retrieve
+            include_prompt: Also yield ("prompt", build_rag_prompt result) before generating
+
+        Yields:
+            ("stage", name), ("status", text), ("prompt", dict), ("delta", text),
+            ("references", text) or ("error", text) events
+        """
+        async with self._slots:
+            async with aclosing(self._answer(query, history or [], k, include_prompt)) as events:
+                async for event in events:
+                    yield event
+
+    async def _answer(self, query: str, history: List[dict], k: int, include_prompt: bool) -> AsyncIterator[Event]:
+        trace = start_trace("answer") # no-op unless TRACE_EXPORTERS is set
+        stage = "embed"
+        try:
+            # The semantic cache only serves first turns: later answers depend on the chat history
+            use_cache = self.semantic_cache is not None and not history
+            mode = RetrievalConfig.get_retrieval_info()["mode"]
+            yield "status", self.status["retrieve"]
+            query_embedding = None
+            if use_cache or mode != "lexical": # lexical retrieval only needs the embedding for the semantic cache
+                yield "stage", stage
+                with trace.span("embed"):
+                    query_embedding = await self._run(stage, embed_query, query)
+
+            stage = "retrieve"
+            yield "stage", stage
+            with trace.span("retrieve"):
+                results_query = await self._run(stage, retrieve, self.db, query, k=k, mode=mode,
+                                                query_embedding=query_embedding, store=self.store)
+            trace.count("retrieved", len(results_query))
+            document_ids = [row[2] for row in results_query]
+
+            if use_cache:
+                with trace.span("semantic_cache"):
+                    data_version = await self._run("semantic_cache", self.db.get_data_version)
+                    cached = await self._run("semantic_cache", self.semantic_cache.lookup, query_embedding,
+                                             document_ids, data_version)
+                if cached is not None:
+                    trace.count("semantic_cache_hits")
+                    # Replay the cached answer and its references, skipping the reranker and the LLM
+                    cached_answer, references = cached
+                    yield "stage", "generate"
+                    yield "status", self.status["generate"]
+                    for delta in self.semantic_cache.replay(cached_answer):
+                        yield "delta", delta
+                    yield "references", references
+                    return
+
+            stage = "rerank"
+            yield "stage", stage
+            yield "status", self.status["rerank"]
+            with trace.span("rerank"):
+                scores = await self._run(stage, rerank, query, results_query, mode=mode)
+            # Relevant documents, best first, so the prompt packer drops the lowest-ranked ones
+            ranked = sorted(zip((row[0] for row in results_query), scores), key=lambda x: x[1], reverse=True)
+            documents = [text for text, score in ranked if score >= 0]
+            trace.count("relevant", len(documents))
+            if not documents:
+                yield "error", LanguageConfig.get_message("no_results_error", self.language)
+                return
+
+            # RAG prompt: history and documents packed into the token budget
+            stage = "prompt"
+            yield "stage", stage
+            with trace.span("prompt"):
+                prompt = await self._run(stage, build_rag_prompt, query, documents, history, language=self.language)
+            trace.count("prompt_documents", len(prompt["documents"]))
+            trace.count("prompt_tokens", prompt["tokens"]["total"])
+            if include_prompt:
+                yield "prompt", prompt
+
+            stage = "llm"
+            yield "stage", "generate"
+            yield "status", self.status["generate"]
+            parts = []
+            try:
+                async with aclosing(self._generate(prompt["messages"], trace)) as deltas: # stops the stream on cancel
+                    async for delta in deltas:
+                        parts.append(delta)
+                        yield "delta", delta
+            except QueueFullError: # every LLM worker is busy and the queue stayed full (LLM_WORKERS)
+                yield "error", LanguageConfig.get_message("busy_error", self.language)
+                return
+
+            if use_cache: # stored under the data version the answer was retrieved from
+                await self._run("semantic_cache", self.semantic_cache.store, query_embedding, document_ids,
+                                "".join(parts), prompt["str_documents"], data_version)
+            yield "references", prompt["str_documents"]
+        except asyncio.TimeoutError:
+            trace.count(f"{stage}_timeouts")
+            yield "error", LanguageConfig.get_message("timeout_error", self.language)
+        finally:
+            trace.finish()
@@ -0,0 +1,181 @@
+"""
+Token-budgeted prompt packing for TinyRAG
+
+The RAG prompt (template + retrieved documents) and the chat history are fitted
+into a token budget counted with the LLM tokenizer, so prefill cost is bounded
+per request however long the chat gets. The oldest turns are dropped first,
+then the lowest-ranked documents; the last message and the last document that
+only partly fit are truncated. The references Gradio appends to each answer
+are not part of the history.
+"""
+from typing import Callable, List, Optional
+
+from config import CacheConfig, LanguageConfig, PromptConfig
+from streaming import REFERENCES_PREFIX
+
+# Approximate tokens the chat template adds around each message (role header, end of turn)
+MESSAGE_OVERHEAD = 5
+# Approximate tokens of the chat template's own preamble (default system header)
+TEMPLATE_OVERHEAD = 32
+
+
+def truncate_to_tokens(text: str, max_tokens: int, count_tokens: Callable[[str], int]) -> str:
+    """Return the longest prefix of text that has at most max_tokens tokens"""
+    if count_tokens(text) <= max_tokens:
+        return text
+    low, high = 0, len(text)
+    while low < high: # binary search on the character length
+        mid = (low + high + 1) // 2
+        if count_tokens(text[:mid]) <= max_tokens:
+            low = mid
+        else:
+            high = mid - 1
+    return text[:low]
+
+
+def _history_message(message: dict) -> dict:
+    """Return a history message without the references Gradio shows after an answer"""
+    if message["role"] != "assistant" or REFERENCES_PREFIX not in message["content"]:
+        return message
+    return {**message, "content": message["content"].split(REFERENCES_PREFIX, 1)[0]}
+
+
+def _truncate_messages(messages: List[dict], max_tokens: int, count_tokens: Callable[[str], int], min_tokens: int) -> List[dict]:
+    """
+    Fit consecutive messages into max_tokens, truncating their ends
+
+    The first message (a question) gets at most half of the room, the rest is
+    shared in order. Returns [] when a message would keep fewer than min_tokens.
+    """
+    kept = []
+    for position, message in enumerate(messages):
+        room = max_tokens // 2 if position == 0 and len(messages) > 1 else max_tokens
+        content = truncate_to_tokens(message["content"], room - MESSAGE_OVERHEAD, count_tokens)
+        tokens = count_tokens(content)
+        if tokens < min(min_tokens, count_tokens(message["content"])):
+            return []
+        kept.append({**message, "content": content})
+        max_tokens -= MESSAGE_OVERHEAD + tokens
+    return kept
+
+
+def pack_prompt(
+    query: str,
+    documents: List[str],
+    history: List[dict],
+    template: str,
+    count_tokens: Callable[[str], int],
+    budget: int = 4096,
+    history_budget: int = 1024,
+    min_document_tokens: int = 64,
+    query_message: bool = False
+):
+    """
+    Fit chat history and documents into a token budget
+
+    Args:
+        query: User query string
+        documents: Retrieved documents, best first
+        history: Previous messages (dicts with 'role' and 'content'), oldest first
+        template: RAG prompt with {query} and {documents} placeholders
+        count_tokens: Function returning the number of LLM tokens of a text
+        budget: Maximum tokens of the whole prompt
+        history_budget: Maximum tokens of the history within the budget
+        min_document_tokens: A document or message is dropped rather than truncated below this many tokens
+        query_message: Also send the query as its own message before the RAG prompt. The
+            next turn's history holds the query, not the RAG prompt, so with a prompt cache
+            the next prompt then starts with the same tokens up to this query
+
+    Returns:
+        Dictionary with 'messages' (LLM messages), 'documents' (kept documents,
+        possibly the last one truncated), 'str_documents' (documents as inserted
+        in the prompt) and 'tokens' (counts of each part and the total)
+    """
+    template_tokens = TEMPLATE_OVERHEAD + MESSAGE_OVERHEAD + count_tokens(template.format(query=query, documents=""))
+    if query_message:
+        template_tokens += MESSAGE_OVERHEAD + count_tokens(query)
+
+    # Keep the newest turns that fit, truncating the message that only partly fits
+    history_tokens = 0
+    kept_history = []
+    available = min(history_budget, budget - template_tokens)
+    history = [_history_message(message) for message in history]
+    for index in range(len(history) - 1, -1, -1):
+        message = history[index]
+        tokens = MESSAGE_OVERHEAD + count_tokens(message["content"])
+        if history_tokens + tokens <= available:
+            kept_history.insert(0, message)
+            history_tokens += tokens
+            continue
+        partial = history[index:index + 1]
+        if message["role"] == "assistant" and index > 0 and history[index - 1]["role"] == "user":
+            partial = history[index - 1:index + 1] # keep the question of a truncated answer
+        truncated = _truncate_messages(partial, available - history_tokens, count_tokens, min_document_tokens)
+        kept_history[:0] = truncated
+        history_tokens += sum(MESSAGE_OVERHEAD + count_tokens(m["content"]) for m in truncated)
+        break
+    if kept_history and kept_history[0]["role"] != "user": # do not start the history in the middle of a turn
+        history_tokens -= MESSAGE_OVERHEAD + count_tokens(kept_history.pop(0)["content"])
+
+    # Keep the best documents that fit, truncating the last one if enough room is left
+    document_tokens = 0
+    kept_documents = []
+    available = budget - template_tokens - history_tokens
+    for document in documents:
+        line = "- " + document.strip()
+        tokens = count_tokens(line) + 1 # + newline
+        if document_tokens + tokens > available:
+            remaining = available - document_tokens - 1
+            if remaining >= min_document_tokens:
+                line = truncate_to_tokens(line, remaining, count_tokens)
+                kept_documents.append(line[2:])
+                document_tokens += count_tokens(line) + 1
+            break
+        kept_documents.append(document.strip())
+        document_tokens += tokens
+
+    str_documents = "\n".join("- " + document for document in kept_documents)
+    messages = list(kept_history)
+    if query_message:
+        messages.append({"role": "user", "content": query})
+    messages.append({"role": "user", "content": template.format(query=query, documents=str_documents)})
+    return {
+        "messages": messages,
+        "documents": kept_documents,
+        "str_documents": str_documents,
+        "tokens": {
+            "template": template_tokens,
+            "history": history_tokens,
+            "documents": document_tokens,
+            "total": template_tokens + history_tokens + document_tokens,
+            "dropped_messages": len(history) - len(kept_history),
+            "dropped_documents": len(documents) - len(kept_documents)
+        }
+    }
+
+
+def build_rag_prompt(query: str, documents: List[str], history: Optional[List[dict]] = None, language: Optional[str] = None):
+    """
+    Pack the RAG prompt of an app within the configured token budget (see pack_prompt)
+
+    Args:
+        query: User query string
+        documents: Documents that passed the reranker, best first
+        history: Previous messages, oldest first
+        language: Language of the rag_prompt template (default from LanguageConfig)
+    """
+    from llm import count_llm_tokens # loads the LLM tokenizer on first use
+
+    info = PromptConfig.get_prompt_info()
+    prompt_cache = CacheConfig.get_cache_info()["llm_prompt_cache"] is not None
+    return pack_prompt(
+        query,
+        documents,
+        history or [],
+        LanguageConfig.get_message("rag_prompt", language),
+        count_llm_tokens,
+        budget=info["budget"],
+        history_budget=info["history_budget"],
+        min_document_tokens=info["min_document_tokens"],
+        query_message=prompt_cache
+    )
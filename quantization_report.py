@@ -0,0 +1,113 @@
+"""
+Compare float, int8 and bit-quantized vector storage on an existing database
+
+Copies the float embeddings of a database into one temporary database per
+storage type and reports file size, query latency and recall@k against the
+exact float search. Queries are stored embeddings with a little Gaussian
+noise added, so no embedding model is loaded.
+
+With --prefilter-dims, also reports two-stage search on truncated
+(Matryoshka) prefixes of the embeddings, as float and int8.
+
+Quantized and prefiltered storages rescore their candidates with float16
+copies of the full vectors, so their recall also includes the float16
+rounding; the recall of an exact search on the float16 vectors alone is
+reported separately.
+
+Usage:
+    python quantization_report.py wiki.db --k 5 --queries 200 --oversample 8
+    python quantization_report.py wiki.db --prefilter-dims 128,256
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from database import Database
+
+
+def load_embeddings(db_path: str):
+    """Read every (document_id, float embedding) pair from a database"""
+    rows = list(Database(db_path).get_embeddings())
+    ids = [row[0] for row in rows]
+    embeddings = np.stack([row[1] for row in rows])
+    return ids, embeddings
+
+
+def float16_recall(embeddings, queries, k: int, batch_size: int = 32) -> float:
+    """Recall@k of an exact search on the float16 vectors (as kept for rescoring) against the float32 search"""
+    rounded = embeddings.astype(np.float16).astype(np.float32)
+    hits = []
+    for start in range(0, len(queries), batch_size):
+        batch = np.asarray(queries[start:start + batch_size], dtype=np.float32)
+        exact, approximate = (
+            np.argsort(np.einsum("ij,ij->i", matrix, matrix)[None, :] - 2 * batch @ matrix.T, axis=1)[:, :k]
+            for matrix in (embeddings, rounded)
+        )
+        hits.extend(len(set(e) & set(a)) / len(e) for e, a in zip(exact, approximate))
+    return float(np.mean(hits))
+
+
+def build(path: str, ids, embeddings, quantization, prefilter_dim=None):
+    """Build a vectors-only copy of the database with the given quantization and prefilter dimensions"""
+    db = Database(path)
+    db.create_db(embedding_dim=embeddings.shape[1], quantization=quantization, prefilter_dim=prefilter_dim)
+    contents = [str(i) for i in ids] # ids as contents keep every row distinct
+    for start in range(0, len(ids), 1000):
+        db.insert_many(contents[start:start + 1000], embeddings[start:start + 1000].tolist())
+    db.db.execute("VACUUM")
+    return db
+
+
+def run_queries(db: Database, queries, k: int, oversample: int):
+    """Return (latencies in ms, result document ids) for each query"""
+    latencies, results = [], []
+    for query in queries:
+        start = time.perf_counter()
+        rows = db.get_query(query, k=k, oversample=oversample)
+        latencies.append((time.perf_counter() - start) * 1000)
+        results.append([row[2] for row in rows])
+    return np.array(latencies), results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("db", help="database to read embeddings from")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--oversample", type=int, default=8)
+    parser.add_argument("--noise", type=float, default=0.05, help="std of the noise added to query vectors")
+    parser.add_argument("--prefilter-dims", default="", help="comma-separated prefix dimensions to compare")
+    args = parser.parse_args()
+
+    ids, embeddings = load_embeddings(args.db)
+    rng = np.random.default_rng(0)
+    picked = embeddings[rng.choice(len(embeddings), size=min(args.queries, len(embeddings)), replace=False)]
+    scale = np.linalg.norm(picked, axis=1, keepdims=True) / np.sqrt(embeddings.shape[1])
+    queries = (picked + rng.normal(0, args.noise, picked.shape) * scale).astype(np.float32).tolist()
+    print(f"{len(ids)} vectors of dimension {embeddings.shape[1]}, {len(queries)} queries, k={args.k}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        baseline = None
+        storages = [(None, None), ("int8", None), ("bit", None)]
+        for dim in [int(d) for d in args.prefilter_dims.split(",") if d]:
+            storages += [(None, dim), ("int8", dim)]
+        print(f"{'storage':<12} {'size MB':>9} {'p50 ms':>8} {'p95 ms':>8} {f'recall@{args.k}':>10}")
+        for quantization, prefilter_dim in storages:
+            name = (quantization or "float") + (f"/{prefilter_dim}" if prefilter_dim else "")
+            path = os.path.join(tmp, name.replace("/", "_") + ".db")
+            db = build(path, ids, embeddings, quantization, prefilter_dim)
+            latencies, results = run_queries(db, queries, args.k, args.oversample)
+            if baseline is None:
+                baseline = results
+            recall = np.mean([len(set(r) & set(b)) / len(b) for r, b in zip(results, baseline) if b])
+            print(f"{name:<12} {os.path.getsize(path) / 2**20:>9.1f} "
+                  f"{np.percentile(latencies, 50):>8.2f} {np.percentile(latencies, 95):>8.2f} {recall:>10.3f}")
+            db.close()
+    print(f"float16 rescoring vectors alone: recall@{args.k} {float16_recall(embeddings, queries, args.k):.3f}")
+
+
+if __name__ == "__main__":
+    main()
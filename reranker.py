@@ -1,40 +1,183 @@
-from typing import List
-import llama_cpp
-from llama_cpp import Llama as local_llama
-
-
-# Use the pull request from https://github.com/abetlen/llama-cpp-python/pull/1820
-class Llama(local_llama):
-    def tokenize(
-        self, text: bytes, add_bos: bool = True, special: bool = True
-    ) -> List[int]:
-        """Tokenize a string.
-
-        Args:
-            text: The utf-8 encoded string to tokenize.
-            add_bos: Whether to add a beginning of sequence token.
-            special: Whether to tokenize special tokens.
-
-        Raises:
-            RuntimeError: If the tokenization failed.
-
-        Returns:
-            A list of tokens.
-        """
-        return self.tokenizer_.tokenize(text, add_bos, special)
-
-
-reranker_model = Llama.from_pretrained(
-    repo_id="puppyM/bge-reranker-v2-m3-Q4_K_M-GGUF",
-    filename="bge-reranker-v2-m3-q4_k_m.gguf",
-    verbose=False,
-    embedding=True,
-    n_gpu_layers=-1, # Using all GPU. If you don't have gpu, use n_gpu_layers=0.
-    pooling_type=llama_cpp.LLAMA_POOLING_TYPE_RANK
-)
-
-def get_reranker(query:str,documents:List[str])->List[float]:
-    input = [f"{query}</s><s>{doc}" for doc in documents]
-    embeds = reranker_model.embed(input)
-    rank_scores = [embed[0] for embed in embeds]
-    return rank_scores
+import contextlib
+import hashlib
+import math
+import threading
+from typing import List, Optional
+import models
+from batching import MicroBatcher
+from cache import LRUCache, normalize_text
+from config import RerankConfig, ServingConfig
+
+
+def _load():
+    if RerankConfig.get_rerank_info()["backend"] == "onnx":
+        from onnx_models import OnnxReranker
+        return OnnxReranker() # int8 ONNX export of the same model, same scores interface
+
+    import llama_cpp
+    from llama_cpp import Llama as local_llama
+
+    # Use the pull request from https://github.com/abetlen/llama-cpp-python/pull/1820
+    class Llama(local_llama):
+        def tokenize(
+            self, text: bytes, add_bos: bool = True, special: bool = True
+        ) -> List[int]:
+            """Tokenize a string.
+
+            Args:
+                text: The utf-8 encoded string to tokenize.
+                add_bos: Whether to add a beginning of sequence token.
+                special: Whether to tokenize special tokens.
+
+            Raises:
+                RuntimeError: If the tokenization failed.
+
+            Returns:
+                A list of tokens.
+            """
+            return self.tokenizer_.tokenize(text, add_bos, special)
+
+    return Llama.from_pretrained(
+        repo_id="puppyM/bge-reranker-v2-m3-Q4_K_M-GGUF",
+        filename="bge-reranker-v2-m3-q4_k_m.gguf",
+        verbose=False,
+        embedding=True,
+        n_gpu_layers=-1, # Using all GPU. If you don't have gpu, use n_gpu_layers=0.
+        pooling_type=llama_cpp.LLAMA_POOLING_TYPE_RANK
+    )
+
+
+models.register("reranker", _load) # loaded on first use
+
+# Score given to documents the cascade accepts without reranking / cuts before reranking
+ACCEPTED = math.inf
+SKIPPED = -math.inf
+
+_config = RerankConfig.get_rerank_info()
+_score_cache = LRUCache(_config["cache_size"]) if _config["cache_size"] > 0 else None
+_stats = {"queries": 0, "model_calls": 0, "pairs_scored": 0, "pairs_cached": 0, "pairs_skipped": 0}
+_stats_lock = threading.Lock()
+
+
+# One Llama instance is not thread-safe: concurrent requests take turns reranking
+# (the ONNX Runtime session can be run from several threads at once; its tokenizer has its own lock)
+_reranker_lock = threading.Lock() if _config["backend"] != "onnx" else contextlib.nullcontext()
+
+
+def _score_pairs(input: List[str]) -> List[float]:
+    """Score "query</s><s>document" inputs in one reranker call"""
+    with _reranker_lock:
+        embeds = models.get("reranker").embed(input)
+    return [embed[0] for embed in embeds]
+
+
+_serving = ServingConfig.get_serving_info()
+# Batches pairs from concurrent queries into shared reranker calls (MICRO_BATCH=1)
+_pair_batcher = MicroBatcher(
+    _score_pairs, _serving["micro_batch_size"], _serving["micro_batch_wait_ms"], name="reranker"
+) if _serving["micro_batch"] else None
+
+
+def _count(**counts):
+    with _stats_lock:
+        for key, value in counts.items():
+            _stats[key] += value
+
+
+def get_reranker_stats() -> dict:
+    """Return reranker counters (model calls, pairs scored / served from cache / skipped by the cascade)"""
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["model_calls_per_query"] = stats["model_calls"] / stats["queries"] if stats["queries"] else 0.0
+    if _score_cache is not None:
+        stats["cache"] = _score_cache.stats()
+    if _pair_batcher is not None:
+        stats["micro_batching"] = _pair_batcher.stats()
+    return stats
+
+
+def _cascade(distances: List[float]) -> List[Optional[float]]:
+    """
+    Decide from the KNN distances which documents need the reranker
+
+    Returns:
+        For each document: None to rerank it, or ACCEPTED / SKIPPED
+    """
+    decisions = [None] * len(distances)
+    if not distances:
+        return decisions
+    best = min(distances)
+    if _config["skip_margin"] > 0:
+        ordered = sorted(distances)
+        if len(ordered) == 1 or ordered[1] - ordered[0] >= _config["skip_margin"]:
+            # Clear winner: take it without reranking and drop the rest
+            winner = distances.index(best)
+            return [ACCEPTED if i == winner else SKIPPED for i in range(len(distances))]
+    if _config["max_gap"] > 0:
+        decisions = [SKIPPED if d - best > _config["max_gap"] else None for d in distances]
+    if _config["max_docs"] > 0:
+        for rank, i in enumerate(sorted(range(len(distances)), key=lambda i: distances[i])):
+            if rank >= _config["max_docs"]:
+                decisions[i] = SKIPPED
+    return decisions
+
+
+def _document_key(document: str) -> bytes:
+    """Score cache key of a document: a hash of its text, so reused document ids never match stale scores"""
+    return hashlib.blake2b(document.encode("utf-8"), digest_size=16).digest()
+
+
+def get_reranker(query:str,documents:List[str],distances:Optional[List[float]]=None)->List[float]:
+    """
+    Score documents against a query with the cross-encoder
+
+    Args:
+        query: User query string
+        documents: Document texts
+        distances: Optional KNN distances of the documents; enables the cascade (RERANK_* settings)
+
+    Returns:
+        Score of each document (>= 0 is relevant). With the cascade, documents accepted
+        without reranking score ACCEPTED (inf) and documents cut before reranking SKIPPED (-inf).
+    """
+    return get_reranker_batch([query], [documents], [distances] if distances is not None else None)[0]
+
+
+def get_reranker_batch(queries: List[str], documents: List[List[str]],
+                       distances: Optional[List[List[float]]] = None) -> List[List[float]]:
+    """
+    Score the documents of several queries, with the pairs of every query in one reranker call
+
+    Args:
+        queries: User query strings
+        documents: Document texts of each query
+        distances: Optional KNN distances of each query's documents (see get_reranker)
+
+    Returns:
+        Scores of each query's documents (see get_reranker)
+    """
+    all_scores, keys, todo = [], [], []
+    skipped = 0
+    for q, (query, docs) in enumerate(zip(queries, documents)):
+        scores = _cascade(distances[q]) if distances is not None else [None] * len(docs)
+        query_keys = [(normalize_text(query), _document_key(doc)) for doc in docs]
+        if _score_cache is not None:
+            for i, key in enumerate(query_keys):
+                if scores[i] is None:
+                    scores[i] = _score_cache.get(key)
+        todo.extend((q, i) for i, score in enumerate(scores) if score is None)
+        skipped += sum(1 for score in scores if score in (ACCEPTED, SKIPPED))
+        all_scores.append(scores)
+        keys.append(query_keys)
+
+    if todo:
+        input = [f"{queries[q]}</s><s>{documents[q][i]}" for q, i in todo]
+        results = _pair_batcher.map(input) if _pair_batcher is not None else _score_pairs(input)
+        for (q, i), score in zip(todo, results):
+            all_scores[q][i] = score
+            if _score_cache is not None:
+                _score_cache.put(keys[q][i], score)
+
+    _count(queries=len(queries), model_calls=1 if todo else 0, pairs_scored=len(todo),
+           pairs_cached=sum(len(docs) for docs in documents) - len(todo) - skipped, pairs_skipped=skipped)
+    return all_scores
@@ -0,0 +1,112 @@
+"""
+Query-side retrieval for TinyRAG
+"""
+from cache import SemanticCache
+from config import CacheConfig, RetrievalConfig
+from database import Database
+from embedding import embed_queries, get_embedding # the model is loaded on first use, never in lexical mode
+from reranker import get_reranker, get_reranker_batch
+from vector_store import SqliteVecStore
+
+
+def embed_query(query: str):
+    """Get the embedding of a query (is_query=True for sentence-transformers)"""
+    return get_embedding(query, is_query=True)["data"][0]['embedding']
+
+
+def retrieve(db: Database, query: str, k: int = 5, mode: str = None, query_embedding=None, store=None):
+    """
+    Retrieve the documents for a query
+
+    Args:
+        db: Database to search
+        query: User query string
+        k: Number of documents to retrieve
+        mode: "vector", "hybrid" or "lexical" (default from RetrievalConfig)
+        query_embedding: Embedding of the query if the caller already has it
+        store: VectorStore for vector search (default: the database's sqlite-vec table)
+
+    Returns:
+        Rows of (contents, score, document_id), best first
+    """
+    info = RetrievalConfig.get_retrieval_info()
+    mode = mode or info["mode"]
+    if mode == "lexical":
+        # Fast path: BM25 only, the query is never embedded
+        return db.get_query_lexical(query, k=k)
+
+    if query_embedding is None:
+        query_embedding = embed_query(query)
+    if mode == "hybrid":
+        return db.get_query_hybrid(query, query_embedding, k=k, candidates=info["candidates"], rrf_k=info["rrf_k"],
+                                   oversample=info["oversample"], store=store)
+    return (store or db).get_query(query_embedding, k=k, oversample=info["oversample"])
+
+
+def retrieve_batch(db: Database, queries, k: int = 5, mode: str = None, query_embeddings=None, store=None):
+    """
+    Retrieve the documents of several queries (see retrieve)
+
+    The vector rankings of all queries come from one store call (a single matrix
+    product with the NumPy store), and each query's texts are read in one query.
+
+    Returns:
+        Rows of (contents, score, document_id) of each query, best first
+    """
+    info = RetrievalConfig.get_retrieval_info()
+    mode = mode or info["mode"]
+    if mode == "lexical":
+        return [db.get_query_lexical(query, k=k) for query in queries]
+
+    if query_embeddings is None:
+        query_embeddings = embed_queries(queries)
+    store = store or SqliteVecStore(db)
+    if mode == "hybrid":
+        rankings = store.get_query_ids_batch(query_embeddings, k=max(info["candidates"], k), oversample=info["oversample"])
+        return [
+            db.get_query_hybrid(query, query_embedding, k=k, candidates=info["candidates"], rrf_k=info["rrf_k"],
+                                vector_ids=ranking)
+            for query, query_embedding, ranking in zip(queries, query_embeddings, rankings)
+        ]
+    return store.get_query_batch(query_embeddings, k=k, oversample=info["oversample"])
+
+
+def rerank(query: str, results, mode: str = None):
+    """
+    Score retrieved rows with the reranker
+
+    KNN distances are handed to the reranker cascade in vector mode only;
+    hybrid and lexical scores are not distances.
+
+    Returns:
+        Score of each row (>= 0 is relevant)
+    """
+    mode = mode or RetrievalConfig.get_retrieval_info()["mode"]
+    return get_reranker(
+        query,
+        [row[0] for row in results],
+        distances=[row[1] for row in results] if mode == "vector" else None
+    )
+
+
+def rerank_batch(queries, results, mode: str = None):
+    """Score the retrieved rows of several queries with one reranker call (see rerank)"""
+    mode = mode or RetrievalConfig.get_retrieval_info()["mode"]
+    return get_reranker_batch(
+        queries,
+        [[row[0] for row in rows] for rows in results],
+        [[row[1] for row in rows] for rows in results] if mode == "vector" else None
+    )
+
+
+def get_semantic_cache(path: str):
+    """Create the semantic answer cache for an app, or return None if SEMANTIC_CACHE is not enabled"""
+    info = CacheConfig.get_cache_info()
+    if not info["semantic_cache"]:
+        return None
+    return SemanticCache(
+        path,
+        max_distance=info["semantic_cache_distance"],
+        ttl=info["semantic_cache_ttl"],
+        max_entries=info["semantic_cache_size"]
+    )
@@ -1,13 +1,44 @@
+import asyncio
+
 from database import Database # for query database
-from llm import get_llm_output, get_llm_stream # get llm output
-from embedding import get_embedding # covert text to embedding
-from reranker import get_reranker # ranking embedding
-from config import LanguageConfig
+from vector_store import get_vector_store
+from pipeline import RAGPipeline # embed, retrieve, rerank and generate as an async event stream
+from reranker import get_reranker_stats
+from embedding import get_query_cache
 
 db=Database("thailaw.db")
+store=get_vector_store(db) # VECTOR_STORE: sqlite-vec table or memory-mapped NumPy matrix
+pipeline=RAGPipeline(db, store)
 
 import sys
 
+
+async def print_answer(query, streaming):
+    """Print the RAG prompt, then the answer (as it is generated if streaming) and the references"""
+    answer = []
+    async for kind, value in pipeline.answer(query, include_prompt=True):
+        if kind == "prompt":
+            print("RAG Prompt:")
+            print(value["messages"][-1]["content"])
+            print("Tokens:", value["tokens"])
+            print("====================")
+            print("Response:")
+        elif kind == "delta":
+            if streaming:
+                print(value, end="", flush=True)
+            else:
+                answer.append(value)
+        elif kind == "references":
+            print("" if streaming else "".join(answer)) # ends the streamed line
+            print()
+            print("References:")
+            print(value)
+        elif kind == "error":
+            print(value)
+    print()
+    print()
+
+
 # Ask for streaming preference
 print("Enable streaming output? (y/n): ", end="")
 use_streaming = input().lower().startswith('y')
@@ -16,47 +47,9 @@ print()
 while True:
     query = input("Question: ")
     if query.lower() in ['quit', 'exit', 'q']:
+        if get_query_cache() is not None:
+            print("Query embedding cache:", get_query_cache().stats())
+        print("Reranker:", get_reranker_stats())
         break
-        
-    # Get embedding for query (is_query=True for sentence-transformers)
-    if hasattr(get_embedding, '__code__') and 'is_query' in get_embedding.__code__.co_varnames:
-        query_embedding = get_embedding(query, is_query=True)["data"][0]['embedding']
-    else:
-        query_embedding = get_embedding(query)["data"][0]['embedding']
-    results_query = db.get_query(query_embedding)
-    list_txt = []
-    for row in results_query:
-        list_txt.append(row[0])
-    list_txt_rank = get_reranker(query, list_txt) # [float, ...] that match list_txt
-    list_txt = [i for i, j in zip(list_txt, list_txt_rank) if j >= 0]
-    
-    if len(list_txt) == 0:
-        print(LanguageConfig.get_message("no_results_error"))
-        print()
-        print()
-        continue
-        
-    str_txt = '\n'.join(['- ' + i.strip() for i in list_txt])
-    # RAG prompt
-    temp = LanguageConfig.get_message("rag_prompt").format(query=query, documents=str_txt)
-    
-    print("RAG Prompt:")
-    print(temp)
-    print("====================")
-    print("Response:")
-    
-    if use_streaming:
-        # Streaming output
-        for chunk in get_llm_stream([{"role": "user", "content": temp}]):
-            print(chunk, end="", flush=True)
-        print()  # New line after streaming
-    else:
-        # Non-streaming output
-        llm_out = get_llm_output([{"role": "user", "content": temp}])
-        print(llm_out["choices"][0]['message']["content"])
-    
-    print()
-    print("References:")
-    print(str_txt)
-    print()
-    print()
\ No newline at end of file
+
+    asyncio.run(print_answer(query, use_streaming))
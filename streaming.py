@@ -0,0 +1,187 @@
+"""
+Delta streaming for TinyRAG
+
+Answers are produced as a stream of events: ("status", text) progress
+messages, ("delta", text) pieces of the answer and a final ("references",
+text). Deltas can be coalesced by time or size so a client receives a few
+dozen messages per answer instead of one per token. Two adapters sit on top:
+
+- gradio_stream: Gradio's ChatInterface expects the full text on every yield,
+  so it accumulates deltas (once per coalesced delta, not per token)
+- sse_format / mount_sse_api: Server-Sent Events carrying only the deltas,
+  served next to the Gradio UI
+
+Each adapter has an async twin (gradio_stream_async, sse_format_async) for
+the async event streams of pipeline.py.
+"""
+import json
+import time
+from contextlib import aclosing
+from typing import AsyncIterable, AsyncIterator, Callable, Iterable, Iterator, Tuple
+
+Event = Tuple[str, str]
+
+# Separates an answer from its references in the text shown by Gradio (and sent back as chat history)
+REFERENCES_PREFIX = "\n\nReferences:\n"
+
+
+class _Coalescer:
+    """Buffer deltas until interval_ms have passed since the last flush or max_bytes are buffered"""
+
+    def __init__(self, interval_ms: float = 50, max_bytes: int = 0):
+        self.interval = interval_ms / 1000
+        self.max_bytes = max_bytes
+        self._buffer = []
+        self._size = 0
+        self._last = time.monotonic()
+
+    def add(self, delta: str):
+        """Buffer a delta; return the merged text if it is time to emit it, else None"""
+        self._buffer.append(delta)
+        if self.max_bytes:
+            self._size += len(delta.encode("utf-8"))
+        now = time.monotonic()
+        if (not self.interval and not self.max_bytes) or (self.interval and now - self._last >= self.interval) \
+                or (self.max_bytes and self._size >= self.max_bytes):
+            self._last = now
+            return self.flush()
+        return None
+
+    def flush(self):
+        """Return the buffered text (None if empty) and clear the buffer"""
+        if not self._buffer:
+            return None
+        text = "".join(self._buffer)
+        self._buffer, self._size = [], 0
+        return text
+
+
+def coalesce(deltas: Iterable[str], interval_ms: float = 50, max_bytes: int = 0) -> Iterator[str]:
+    """
+    Merge consecutive deltas
+
+    A merged delta is emitted once interval_ms have passed since the last one
+    or once it reaches max_bytes (UTF-8). With both at 0 every delta is passed
+    through. Whatever is left is emitted when the stream ends.
+    """
+    coalescer = _Coalescer(interval_ms, max_bytes)
+    for delta in deltas:
+        text = coalescer.add(delta)
+        if text is not None:
+            yield text
+    text = coalescer.flush()
+    if text is not None:
+        yield text
+
+
+def coalesce_events(events: Iterable[Event], interval_ms: float = 50, max_bytes: int = 0) -> Iterator[Event]:
+    """Coalesce the ("delta", text) events of an event stream; other events flush the pending text first"""
+    coalescer = _Coalescer(interval_ms, max_bytes)
+    for kind, text in events:
+        if kind == "delta":
+            text = coalescer.add(text)
+            if text is not None:
+                yield "delta", text
+            continue
+        pending = coalescer.flush()
+        if pending is not None:
+            yield "delta", pending
+        yield kind, text
+    pending = coalescer.flush()
+    if pending is not None:
+        yield "delta", pending
+
+
+class _GradioAnswer:
+    """Text Gradio shows after each event: the status message, or the answer so far"""
+
+    def __init__(self, references_prefix: str):
+        self.references_prefix = references_prefix
+        self.parts = []
+
+    def feed(self, kind: str, text):
+        """Return the text to show, or None for events that are not shown ("stage", "prompt")"""
+        if kind == "status":
+            return text
+        if kind == "delta":
+            self.parts.append(text)
+            return "".join(self.parts)
+        if kind == "references":
+            return "".join(self.parts) + self.references_prefix + text
+        if kind == "error": # replaces the partial answer
+            return text
+        return None
+
+
+def gradio_stream(events: Iterable[Event], references_prefix: str = REFERENCES_PREFIX) -> Iterator[str]:
+    """
+    Adapt an event stream to Gradio: yield the status messages, then the answer so far
+
+    The answer is joined once per (coalesced) delta and the references are
+    appended at the end, as Gradio replaces the message with each yielded value.
+    """
+    answer = _GradioAnswer(references_prefix)
+    for kind, text in events:
+        shown = answer.feed(kind, text)
+        if shown is not None:
+            yield shown
+
+
+async def gradio_stream_async(events: AsyncIterable[Event],
+                              references_prefix: str = REFERENCES_PREFIX) -> AsyncIterator[str]:
+    """gradio_stream for an async event stream (see pipeline.py)"""
+    answer = _GradioAnswer(references_prefix)
+    async with aclosing(events):
+        async for kind, text in events:
+            shown = answer.feed(kind, text)
+            if shown is not None:
+                yield shown
+
+
+def _sse_event(kind: str, text) -> str:
+    return f"event: {kind}\ndata: {json.dumps(text, ensure_ascii=False)}\n\n"
+
+
+def sse_format(events: Iterable[Event]) -> Iterator[str]:
+    """Format events as Server-Sent Events, ending with a "done" event"""
+    for kind, text in events:
+        yield _sse_event(kind, text)
+    yield "event: done\ndata: null\n\n"
+
+
+async def sse_format_async(events: AsyncIterable[Event]) -> AsyncIterator[str]:
+    """sse_format for an async event stream"""
+    async with aclosing(events):
+        async for kind, text in events:
+            yield _sse_event(kind, text)
+    yield "event: done\ndata: null\n\n"
+
+
+def mount_sse_api(demo, answer_events: Callable[[str, list, int], AsyncIterable[Event]], path: str = "/api/answer"):
+    """
+    Serve a Gradio app together with an SSE endpoint
+
+    GET {path}?q=...&k=5 streams the events of answer_events(q, [], k) (an
+    async event stream, e.g. RAGPipeline.answer) as Server-Sent Events.
+    Closing the connection closes the event stream, which cancels the LLM
+    request. RAGPipeline.answer admits the SSE requests under the same
+    SERVING_CONCURRENCY limit as the Gradio queue.
+
+    Returns:
+        FastAPI app to run with uvicorn
+    """
+    import gradio as gr
+    from fastapi import FastAPI
+    from fastapi.responses import StreamingResponse
+
+    app = FastAPI()
+
+    @app.get(path)
+    async def answer(q: str, k: int = 5):
+        return StreamingResponse(
+            sse_format_async(answer_events(q, [], k)),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
+
+    return gr.mount_gradio_app(app, demo, path="/")
@@ -0,0 +1,115 @@
+"""
+Deterministic stand-ins for the TinyRAG models
+
+Fast fake models with the same interface as the real ones, for benchmarking
+the rest of the pipeline (database, caches, batching, prompt packing,
+streaming) without downloading or running a model. install() registers them
+in the model registry in place of the real loaders, so it must be called
+before the first models.get().
+
+- StubEmbedder: a pseudo-random unit vector seeded by the text hash
+  (identical texts get identical vectors)
+- StubReranker: word overlap between query and document, shifted so that
+  documents sharing few words score below 0
+- StubLLM: a fixed-length streamed answer, optionally with a per-token delay
+"""
+import hashlib
+import time
+from typing import List, Union
+
+import numpy as np
+
+import models
+
+
+def _seed(text: str) -> int:
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def _tokenize(text: Union[str, bytes]) -> List[int]:
+    """About one token per 4 bytes, like a BPE tokenizer on English text"""
+    if isinstance(text, str):
+        text = text.encode("utf-8")
+    return list(range((len(text) + 3) // 4))
+
+
+class StubEmbedder:
+    """Interface of SentenceTransformer (encode, tokenizer) and llama-cpp Llama (embed, create_embedding, tokenize)"""
+
+    def __init__(self, dim: int = 256):
+        self.dim = dim
+
+    def _embed_one(self, text: str) -> np.ndarray:
+        vector = np.random.default_rng(_seed(text)).standard_normal(self.dim).astype(np.float32)
+        return vector / np.linalg.norm(vector)
+
+    def encode(self, texts, batch_size: int = 32, normalize_embeddings: bool = True, **kwargs):
+        if isinstance(texts, str):
+            return self._embed_one(texts)
+        return np.stack([self._embed_one(text) for text in texts]) if texts else np.zeros((0, self.dim), np.float32)
+
+    def embed(self, texts):
+        if isinstance(texts, str):
+            return self._embed_one(texts).tolist()
+        return [self._embed_one(text).tolist() for text in texts]
+
+    def create_embedding(self, text: str):
+        return {"data": [{"embedding": self._embed_one(text).tolist()}]}
+
+    def tokenizer(self, text: str, add_special_tokens: bool = False):
+        return {"input_ids": _tokenize(text)}
+
+    def tokenize(self, text: bytes, add_bos: bool = True, special: bool = True) -> List[int]:
+        return _tokenize(text)
+
+
+class StubReranker:
+    """Interface of the llama-cpp reranker: embed("query</s><s>document") -> [[score]]"""
+
+    def embed(self, inputs: List[str]) -> List[List[float]]:
+        scores = []
+        for text in inputs:
+            query, _, document = text.partition("</s><s>")
+            query_words = set(query.lower().split())
+            document_words = set(document.lower().split())
+            overlap = len(query_words & document_words) / max(len(query_words), 1)
+            scores.append([overlap * 10 - 2]) # relevant (>= 0) when a fifth of the query words match
+        return scores
+
+
+class StubLLM:
+    """Interface of llama-cpp Llama chat completion and tokenize"""
+
+    def __init__(self, answer_tokens: int = 64, token_delay_ms: float = 0, prefill_ms_per_1k_tokens: float = 0):
+        self.answer_tokens = answer_tokens
+        self.token_delay = token_delay_ms / 1000
+        self.prefill_per_token = prefill_ms_per_1k_tokens / 1000 / 1000
+
+    def tokenize(self, text: bytes, add_bos: bool = True, special: bool = True) -> List[int]:
+        return _tokenize(text)
+
+    def _generate(self, messages):
+        prompt_tokens = sum(len(_tokenize(message["content"])) for message in messages)
+        if self.prefill_per_token:
+            time.sleep(prompt_tokens * self.prefill_per_token)
+        for i in range(self.answer_tokens):
+            if self.token_delay:
+                time.sleep(self.token_delay)
+            yield f"tok{i % 100} "
+
+    def create_chat_completion(self, messages, stream: bool = False, **kwargs):
+        if stream:
+            return ({"choices": [{"delta": {"content": token}}]} for token in self._generate(messages))
+        content = "".join(self._generate(messages))
+        return {"choices": [{"message": {"role": "assistant", "content": content}}]}
+
+
+def install(embedding_dim: int = 256, answer_tokens: int = 64, token_delay_ms: float = 0,
+            prefill_ms_per_1k_tokens: float = 0):
+    """Register the stand-ins in place of the real models"""
+    import embedding, llm, reranker # register the real loaders first so they do not replace the stubs later
+    llm_stub = StubLLM(answer_tokens, token_delay_ms, prefill_ms_per_1k_tokens)
+    models.register("embedding", lambda: StubEmbedder(embedding_dim))
+    models.register("reranker", StubReranker)
+    models.register("llm", lambda: llm_stub)
+    models.register("llm_tokenizer", lambda: llm_stub)
@@ -0,0 +1,27 @@
+"""
+Tests of the full-text query builder (database.fts_query)
+"""
+import sqlite3
+
+from database import fts_query
+
+
+def search(documents, query):
+    """Ids of the documents matching fts_query(query) in a trigram FTS5 table, best first"""
+    db = sqlite3.connect(":memory:")
+    db.execute("CREATE virtual table fts_documents using fts5(contents, tokenize='trigram')")
+    db.executemany("INSERT INTO fts_documents(rowid, contents) VALUES (?, ?)", enumerate(documents))
+    rows = db.execute("SELECT rowid FROM fts_documents WHERE fts_documents MATCH ? ORDER BY bm25(fts_documents)",
+                      [fts_query(query)])
+    return [row[0] for row in rows]
+
+
+def test_short_words_are_joined_to_a_neighbour():
+    assert fts_query("มาตรา 5") == '"มาตรา" OR "มาตรา 5"'
+    assert fts_query("5 ปี") == '"5 ปี"'
+    assert fts_query("a") == ""
+
+
+def test_short_word_phrase_ranks_exact_section_first():
+    documents = ["มาตรา 12 บุคคลย่อมมีสิทธิ", "มาตรา 5 บุคคลย่อมมีสิทธิ", "มาตรา 7 บุคคลย่อมมีสิทธิ"]
+    assert search(documents, "มาตรา 5")[0] == 1
@@ -0,0 +1,51 @@
+"""
+Tests of the LLM worker pool (llm_pool.py) with the stand-in model of stub_models.py
+"""
+import functools
+import time
+
+import pytest
+
+import llm
+import llm_pool
+import stub_models
+
+MESSAGES = [{"role": "user", "content": "question"}]
+
+
+def test_request_after_worker_died(monkeypatch):
+    monkeypatch.setenv("LLM_WORKERS", "1")
+    monkeypatch.setattr(llm_pool, "LLMPool", functools.partial(llm_pool.LLMPool, initializer=stub_models.install))
+    monkeypatch.setattr(llm, "_pool", None)
+    pool = llm.get_llm_pool()
+    try:
+        assert "".join(llm.get_llm_stream(MESSAGES))
+
+        pool._processes[0].kill()
+        pool._processes[0].join()
+        start = time.perf_counter()
+        with pytest.raises(llm_pool.PoolClosedError):
+            list(pool.chat(MESSAGES))
+        assert time.perf_counter() - start < 5 # fails at once instead of waiting for the dead worker
+        assert pool.closed
+
+        # The next request starts a new pool
+        assert "".join(llm.get_llm_stream(MESSAGES))
+        assert llm.get_llm_pool() is not pool
+    finally:
+        pool.close()
+        llm._pool.close()
+
+
+def test_running_request_fails_when_worker_dies():
+    slow_model = functools.partial(stub_models.install, token_delay_ms=50)
+    pool = llm_pool.LLMPool(num_workers=1, initializer=slow_model).start()
+    try:
+        chunks = pool.chat(MESSAGES)
+        next(chunks)
+        pool._processes[0].kill()
+        with pytest.raises(llm_pool.PoolClosedError):
+            for _ in chunks:
+                pass
+    finally:
+        pool.close()
@@ -0,0 +1,70 @@
+"""
+Tests of the token-budgeted prompt packing (prompt.py)
+"""
+from prompt import MESSAGE_OVERHEAD, pack_prompt
+from streaming import REFERENCES_PREFIX
+
+TEMPLATE = "DOCUMENT:\n{documents}\n\nQUESTION: {query}"
+
+
+def count_tokens(text):
+    return len(text.split())
+
+
+def gradio_history(turns):
+    """Convert (user, assistant) tuples to messages the way the apps' respond() does"""
+    messages = []
+    for user, assistant in turns:
+        if user:
+            messages.append({"role": "user", "content": user})
+        if assistant:
+            messages.append({"role": "assistant", "content": assistant})
+    return messages
+
+
+def answer(words, references=300):
+    return " ".join(["answer"] * words) + REFERENCES_PREFIX + "\n".join("- reference document" for _ in range(references))
+
+
+def test_references_are_stripped_from_history():
+    history = gradio_history([("first question", answer(20)), ("second question", answer(20))])
+    packed = pack_prompt("third question", ["a document"], history, TEMPLATE, count_tokens, history_budget=200)
+
+    assert packed["tokens"]["dropped_messages"] == 0
+    assert [m["role"] for m in packed["messages"]] == ["user", "assistant", "user", "assistant", "user"]
+    assert all("reference" not in m["content"] for m in packed["messages"][:-1])
+    assert packed["tokens"]["history"] == 2 * (2 * MESSAGE_OVERHEAD + 2 + 20)
+
+
+def test_long_answer_is_truncated_not_dropped():
+    history = gradio_history([("old question", answer(10)), ("last question", answer(500))])
+    packed = pack_prompt("new question", ["a document"], history, TEMPLATE, count_tokens,
+                         history_budget=100, min_document_tokens=8)
+
+    messages = packed["messages"]
+    assert [m["role"] for m in messages] == ["user", "assistant", "user"]
+    assert messages[0]["content"] == "last question"
+    assert messages[1]["content"].startswith("answer answer")
+    assert 0 < packed["tokens"]["history"] <= 100
+    assert packed["tokens"]["dropped_messages"] == 2
+
+
+def test_history_within_budget_with_small_budget():
+    history = gradio_history([("question " * 50, answer(50))])
+    packed = pack_prompt("new question", [], history, TEMPLATE, count_tokens, history_budget=40, min_document_tokens=8)
+
+    assert packed["tokens"]["history"] <= 40
+    assert [m["role"] for m in packed["messages"]] == ["user", "assistant", "user"]
+
+
+def test_query_message_keeps_next_turn_prefix():
+    first = pack_prompt("first question", ["document one"], [], TEMPLATE, count_tokens, query_message=True)
+    answer_text = "first answer"
+    history = gradio_history([("first question", answer_text + REFERENCES_PREFIX + first["str_documents"])])
+    second = pack_prompt("second question", ["document two"], history, TEMPLATE, count_tokens, query_message=True)
+
+    # The second prompt repeats the first one up to its query, then the answer
+    assert second["messages"][0] == first["messages"][0] == {"role": "user", "content": "first question"}
+    assert second["messages"][1] == {"role": "assistant", "content": answer_text}
+    assert second["messages"][2]["content"] == "second question"
+    assert "document two" in second["messages"][3]["content"]
@@ -4,6 +4,7 @@ Test streaming functionality to debug the issue
 """
 import gradio as gr
 from llm import get_llm_stream
+from streaming import coalesce
 
 def simple_stream_test(message, history):
     """Simple streaming test without RAG"""
@@ -19,11 +20,11 @@ def simple_stream_test(message, history):
     # Add current message
     messages.append({"role": "user", "content": message})
     
-    # Stream the response
-    response_text = ""
-    for chunk in get_llm_stream(messages):
-        response_text += chunk
-        yield response_text
+    # Stream the response: deltas merged every 50 ms, joined once per merged delta
+    parts = []
+    for delta in coalesce(get_llm_stream(messages), interval_ms=50):
+        parts.append(delta)
+        yield "".join(parts)
 
 # Create simple ChatInterface for testing
 demo = gr.ChatInterface(
@@ -1,34 +1,32 @@
-from datasets import load_dataset
+import itertools
+import time
 from database import Database
-from embedding import get_embedding
-from tqdm.auto import tqdm
+from embedding import get_embedding_dimension
+from config import IngestConfig
+from ingest import dataset_texts, ingest
 
-ds = load_dataset("airesearch/WangchanX-Legal-ThaiCCL-RAG")
 
-train_df=ds["train"].to_pandas()
-test_df=ds["test"].to_pandas()
+if __name__ == "__main__": # required for multi-process ingestion (INGEST_WORKERS > 1)
+    # Contexts of both splits, read a chunk of rows at a time; repeated contexts are skipped by ingest()
+    contexts = ["positive_contexts", "hard_negative_contexts"]
+    list_law = itertools.chain(
+        dataset_texts("airesearch/WangchanX-Legal-ThaiCCL-RAG", contexts, split="train"),
+        dataset_texts("airesearch/WangchanX-Legal-ThaiCCL-RAG", contexts, split="test")
+    ) # texts, consumed as they are embedded
 
-_temp=set()
-for i in train_df["positive_contexts"]:
-    for j in i:
-        _temp.add(j['text'])
-for i in train_df["hard_negative_contexts"]:
-    for j in i:
-        _temp.add(j['text'])
-for i in test_df["positive_contexts"]:
-    for j in i:
-        _temp.add(j['text'])
-for i in test_df["hard_negative_contexts"]:
-    for j in i:
-        _temp.add(j['text'])
+    # Create database
+    db=Database("thailaw.db") # thailaw.db
+    # Get embedding model dimension and create database
+    embedding_dim = get_embedding_dimension()
+    print(f"Creating database with embedding dimension: {embedding_dim}")
+    ingest_info = IngestConfig.get_ingest_info()
+    db.create_db(embedding_dim=embedding_dim, quantization=ingest_info["quantization"],
+                 compression=ingest_info["compression"], prefilter_dim=ingest_info["prefilter_dim"])
 
-list_law=list(_temp) # list of texts
-del list_law[list_law.index('')] # del error from dataset
-
-# Create database
-db=Database("thailaw.db") # thailaw.db
-db.create_db()
-
-# insert data to database
-for text in tqdm(list_law):
-    db.insert(text, get_embedding(text)["data"][0]['embedding'])
+    # insert data to database in batches
+    start = time.perf_counter()
+    stats = ingest("thailaw.db", list_law)
+    elapsed = time.perf_counter() - start
+    print(f"Inserted {stats['documents']} documents as {stats['chunks']} chunks in {elapsed:.1f}s "
+          f"({stats['documents'] / elapsed:.1f} docs/sec, {stats['chunks'] / elapsed:.1f} chunks/sec); "
+          f"skipped {stats['skipped']} already in the database or repeated")
@@ -0,0 +1,144 @@
+"""
+Evaluate retrieval quality and speed on the WangchanX-Legal-ThaiCCL-RAG test split
+
+Runs the test questions in batches through embedding, retrieval (one store
+call per batch) and optionally the reranker (one model call per batch)
+against a database built with thailaw_create-db.py, and reports recall@k,
+MRR and nDCG@k against the labeled positive_contexts, plus queries/sec of each
+stage. A retrieved chunk counts as its parent document. The dataset is read
+from the local Hugging Face cache; pass --online to allow downloading it.
+
+Usage:
+    python thailaw_eval.py --db thailaw.db --k 1,5,10 --mode vector
+    python thailaw_eval.py --db thailaw_int8.db --k 5,10 --rerank --candidates 20 --output eval.json
+"""
+import argparse
+import json
+import math
+import os
+import time
+
+import models
+from database import Database, content_hash
+
+
+def load_test_split(online: bool = False, limit: int = 0):
+    """Return (questions, set of positive context hashes of each question)"""
+    if not online: # read the cached dataset without any network access
+        os.environ["HF_HUB_OFFLINE"] = "1"
+        os.environ["HF_DATASETS_OFFLINE"] = "1"
+    from datasets import load_dataset
+
+    test_df = load_dataset("airesearch/WangchanX-Legal-ThaiCCL-RAG", split="test").to_pandas()
+    questions, relevant = [], []
+    for question, contexts in zip(test_df["question"], test_df["positive_contexts"]):
+        hashes = {content_hash(context["text"]) for context in contexts if context["text"]}
+        if hashes:
+            questions.append(question)
+            relevant.append(hashes)
+    if limit:
+        questions, relevant = questions[:limit], relevant[:limit]
+    return questions, relevant
+
+
+def parent_hashes(db: Database, results):
+    """Content hashes of the parent documents of each query's rows, duplicates (other chunks of a parent) removed"""
+    ids = list({row[2] for rows in results for row in rows})
+    found = {}
+    for start in range(0, len(ids), 500): # stay below SQLite's variable limit
+        chunk = ids[start:start + 500]
+        found.update(db.reader.execute(
+            f"SELECT document_id, content_hash FROM documents WHERE document_id IN ({','.join('?' * len(chunk))})", chunk
+        ).fetchall())
+    return [list(dict.fromkeys(found[row[2]] for row in rows if row[2] in found)) for rows in results]
+
+
+def score(ranking, relevant, ks):
+    """recall@k and nDCG@k for each k, and the reciprocal rank, of one query"""
+    metrics = {}
+    for k in ks:
+        hits = [1 if h in relevant else 0 for h in ranking[:k]]
+        metrics[f"recall@{k}"] = sum(hits) / len(relevant)
+        dcg = sum(hit / math.log2(rank + 2) for rank, hit in enumerate(hits))
+        idcg = sum(1 / math.log2(rank + 2) for rank in range(min(len(relevant), k)))
+        metrics[f"ndcg@{k}"] = dcg / idcg
+    metrics["mrr"] = next((1 / (rank + 1) for rank, h in enumerate(ranking) if h in relevant), 0.0)
+    return metrics
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default="thailaw.db")
+    parser.add_argument("--k", default="1,5,10", help="comma-separated cutoffs")
+    parser.add_argument("--mode", choices=["vector", "hybrid", "lexical"], default=None, help="default: RETRIEVAL_MODE")
+    parser.add_argument("--rerank", action="store_true", help="rerank the retrieved candidates")
+    parser.add_argument("--candidates", type=int, default=0, help="documents retrieved per query (default: max k)")
+    parser.add_argument("--batch-size", type=int, default=32, help="questions per embedding, retrieval and rerank batch")
+    parser.add_argument("--vector-store", choices=["sqlite", "numpy"], default=None, help="default: VECTOR_STORE")
+    parser.add_argument("--limit", type=int, default=0, help="only evaluate the first questions")
+    parser.add_argument("--online", action="store_true", help="allow downloading the dataset")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    from config import RetrievalConfig
+    from retrieval import rerank_batch, retrieve_batch
+    from vector_store import get_vector_store
+
+    ks = sorted(int(k) for k in args.k.split(","))
+    mode = args.mode or RetrievalConfig.get_retrieval_info()["mode"]
+    candidates = max(args.candidates, ks[-1])
+    questions, relevant = load_test_split(args.online, args.limit)
+    db = Database(args.db)
+    store = get_vector_store(db, args.vector_store)
+    print(f"{len(questions)} questions, mode={mode}, quantization={db.settings.get('quantization')}, "
+          f"rerank={args.rerank}, candidates={candidates}")
+
+    timings = {"embed": 0.0, "retrieve": 0.0, "rerank": 0.0}
+    query_embeddings = [None] * len(questions)
+    if mode != "lexical":
+        from embedding import embed_queries
+        models.warmup(["embedding"])
+        start = time.perf_counter()
+        query_embeddings = embed_queries(questions, batch_size=args.batch_size)
+        timings["embed"] = time.perf_counter() - start
+    if args.rerank:
+        models.warmup(["reranker"])
+
+    totals = {}
+    for batch in range(0, len(questions), args.batch_size):
+        batch_questions = questions[batch:batch + args.batch_size]
+        start = time.perf_counter()
+        results = retrieve_batch(db, batch_questions, k=candidates, mode=mode, store=store,
+                                 query_embeddings=query_embeddings[batch:batch + args.batch_size])
+        timings["retrieve"] += time.perf_counter() - start
+        if args.rerank:
+            start = time.perf_counter()
+            batch_scores = rerank_batch(batch_questions, results, mode=mode)
+            timings["rerank"] += time.perf_counter() - start
+            results = [[row for row, _ in sorted(zip(rows, scores), key=lambda x: x[1], reverse=True)]
+                       for rows, scores in zip(results, batch_scores)]
+        for ranking, positives in zip(parent_hashes(db, results), relevant[batch:batch + args.batch_size]):
+            for name, value in score(ranking, positives, ks).items():
+                totals[name] = totals.get(name, 0.0) + value
+
+    metrics = {name: value / len(questions) for name, value in totals.items()}
+    total_time = sum(timings.values())
+    speed = {f"{stage}_qps": len(questions) / seconds for stage, seconds in timings.items() if seconds > 0}
+    speed["qps"] = len(questions) / total_time if total_time > 0 else 0.0
+
+    for name, value in metrics.items():
+        print(f"{name:<12} {value:.4f}")
+    for name, value in speed.items():
+        print(f"{name:<12} {value:.1f}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({
+                "config": {"db": args.db, "mode": mode, "quantization": db.settings.get("quantization"),
+                           "rerank": args.rerank, "candidates": candidates, "questions": len(questions)},
+                "metrics": metrics,
+                "speed": speed
+            }, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+"""
+Per-stage latency tracing for TinyRAG
+
+A trace records how long each stage of one request took (spans), the LLM
+time-to-first-token, decode time and tokens/sec, and counters such as the
+number of documents retrieved. Finished traces go to the exporters listed in
+TRACE_EXPORTERS:
+
+- log: one line per request on stderr
+- jsonl: one JSON object per request appended to TRACE_JSONL_PATH
+- prometheus: aggregated metrics in the Prometheus text format on
+  http://TRACE_PROMETHEUS_HOST:TRACE_PROMETHEUS_PORT/metrics (127.0.0.1 by default)
+
+Traces are passed explicitly (Gradio may resume a streaming generator on a
+different thread, so thread-local state would be lost). With no exporter
+configured start_trace() returns a no-op trace and tracing costs a method call
+per stage.
+"""
+import json
+import sys
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Iterable, Iterator, List, Optional
+
+from config import TracingConfig
+
+
+class Trace:
+    """Timings and counters of one request"""
+
+    def __init__(self, name: str, exporters: List):
+        self.name = name
+        self.start = time.time()
+        self.spans = {} # stage -> seconds (summed if a stage runs more than once)
+        self.counters = {}
+        self._start = time.perf_counter()
+        self._exporters = exporters
+        self._finished = False
+
+    @contextmanager
+    def span(self, name: str):
+        """Time a stage"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.spans[name] = self.spans.get(name, 0.0) + time.perf_counter() - start
+
+    def count(self, name: str, value: float = 1):
+        """Add to a counter"""
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def stream(self, name: str, chunks: Iterable) -> Iterator:
+        """
+        Time a token stream
+
+        Records {name}_ttft (time to first chunk, i.e. queueing + prompt prefill),
+        {name}_decode (the rest), the {name}_tokens counter and {name}_tokens_per_s.
+        """
+        start = time.perf_counter()
+        first = None
+        tokens = 0
+        try:
+            for chunk in chunks:
+                if first is None:
+                    first = time.perf_counter()
+                    self.spans[f"{name}_ttft"] = first - start
+                tokens += 1
+                yield chunk
+        finally:
+            end = time.perf_counter()
+            if first is not None:
+                self.spans[f"{name}_decode"] = end - first
+                self.count(f"{name}_tokens", tokens)
+                if end > first:
+                    self.counters[f"{name}_tokens_per_s"] = tokens / (end - first)
+
+    def finish(self):
+        """Record the total time and hand the trace to the exporters (once)"""
+        if self._finished:
+            return
+        self._finished = True
+        self.spans["total"] = time.perf_counter() - self._start
+        for exporter in self._exporters:
+            exporter.export(self)
+
+    def to_dict(self) -> dict:
+        return {
+            "trace": self.name,
+            "start": self.start,
+            "spans_ms": {name: round(seconds * 1000, 3) for name, seconds in self.spans.items()},
+            "counters": self.counters
+        }
+
+
+class _NullTrace:
+    """Trace used when tracing is disabled: every method is a no-op"""
+
+    _span = nullcontext()
+
+    def span(self, name: str):
+        return self._span
+
+    def count(self, name: str, value: float = 1):
+        pass
+
+    def stream(self, name: str, chunks: Iterable) -> Iterable:
+        return chunks
+
+    def finish(self):
+        pass
+
+
+NULL_TRACE = _NullTrace()
+
+
+class LogExporter:
+    """Print one line per trace on stderr"""
+
+    def export(self, trace: Trace):
+        spans = " ".join(f"{name}={seconds * 1000:.1f}ms" for name, seconds in trace.spans.items())
+        counters = " ".join(f"{name}={value:g}" for name, value in trace.counters.items())
+        print(f"[trace] {trace.name} {spans} {counters}".rstrip(), file=sys.stderr)
+
+
+class JsonlExporter:
+    """Append one JSON object per trace to a file"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, trace: Trace):
+        line = json.dumps(trace.to_dict(), ensure_ascii=False)
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+class PrometheusExporter:
+    """Aggregate traces and serve them in the Prometheus text format"""
+
+    def __init__(self, port: Optional[int] = None, host: str = "127.0.0.1"):
+        self._lock = threading.Lock()
+        self._span_sum = {}
+        self._span_count = {}
+        self._counters = {}
+        self._traces = {}
+        if port:
+            exporter = self
+
+            class Handler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    body = exporter.render().encode("utf-8")
+                    self.send_response(200 if self.path.startswith("/metrics") else 404)
+                    self.send_header("Content-Type", "text/plain; version=0.0.4")
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, *args):
+                    pass
+
+            server = ThreadingHTTPServer((host, port), Handler)
+            threading.Thread(target=server.serve_forever, name="prometheus-exporter", daemon=True).start()
+
+    def export(self, trace: Trace):
+        with self._lock:
+            self._traces[trace.name] = self._traces.get(trace.name, 0) + 1
+            for name, seconds in trace.spans.items():
+                key = (trace.name, name)
+                self._span_sum[key] = self._span_sum.get(key, 0.0) + seconds
+                self._span_count[key] = self._span_count.get(key, 0) + 1
+            for name, value in trace.counters.items():
+                if not name.endswith("_per_s"): # rates are not summable, use span and token totals instead
+                    key = (trace.name, name)
+                    self._counters[key] = self._counters.get(key, 0) + value
+
+    def render(self) -> str:
+        """Return the metrics in the Prometheus text format"""
+        lines = [
+            "# HELP tinyrag_traces_total Requests traced",
+            "# TYPE tinyrag_traces_total counter"
+        ]
+        with self._lock:
+            lines += [f'tinyrag_traces_total{{trace="{name}"}} {count}' for name, count in self._traces.items()]
+            lines += [
+                "# HELP tinyrag_span_seconds Time spent in each stage",
+                "# TYPE tinyrag_span_seconds summary"
+            ]
+            for (trace, span), seconds in self._span_sum.items():
+                lines.append(f'tinyrag_span_seconds_sum{{trace="{trace}",span="{span}"}} {seconds:.6f}')
+                lines.append(f'tinyrag_span_seconds_count{{trace="{trace}",span="{span}"}} {self._span_count[(trace, span)]}')
+            lines += [
+                "# HELP tinyrag_events_total Counters recorded by traces",
+                "# TYPE tinyrag_events_total counter"
+            ]
+            for (trace, name), value in self._counters.items():
+                lines.append(f'tinyrag_events_total{{trace="{trace}",name="{name}"}} {value:g}')
+        return "\n".join(lines) + "\n"
+
+
+_exporters = None
+_exporters_lock = threading.Lock()
+
+
+def get_exporters() -> List:
+    """Create the exporters listed in TRACE_EXPORTERS on first use"""
+    global _exporters
+    if _exporters is None:
+        with _exporters_lock:
+            if _exporters is None:
+                info = TracingConfig.get_tracing_info()
+                exporters = []
+                for name in info["exporters"]:
+                    if name == "log":
+                        exporters.append(LogExporter())
+                    elif name == "jsonl":
+                        exporters.append(JsonlExporter(info["jsonl_path"]))
+                    elif name == "prometheus":
+                        exporters.append(PrometheusExporter(info["prometheus_port"], info["prometheus_host"]))
+                    else:
+                        raise ValueError(f"Invalid trace exporter: {name}. Available: ['log', 'jsonl', 'prometheus']")
+                _exporters = exporters
+    return _exporters
+
+
+def start_trace(name: str):
+    """Start a trace for one request, or return NULL_TRACE if no exporter is configured"""
+    exporters = get_exporters()
+    if not exporters:
+        return NULL_TRACE
+    return Trace(name, exporters)
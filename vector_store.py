@@ -0,0 +1,246 @@
+"""
+Vector stores for TinyRAG
+
+A vector store answers KNN queries with the same rows as Database.get_query:
+(contents, distance, document_id), best first, with L2 distances. Stores rank
+ids only (get_query_ids); the texts of the results are read from the database
+afterwards.
+
+- SqliteVecStore: the sqlite-vec vec0 table of the database (default)
+- NumpyVectorStore: an exact search over a memory-mapped float32 copy of the
+  vectors. One matrix product and argpartition answer a whole batch of
+  queries, which beats the vec0 table scan on small hot corpora. The copy is
+  written next to the database. Inserted documents are added to it in
+  memory; it is rewritten after deletions or once the added rows grow past a
+  quarter of it.
+
+get_vector_store() picks the store from VECTOR_STORE.
+"""
+import json
+import os
+import tempfile
+import threading
+from typing import NamedTuple, Optional
+
+import numpy as np
+
+from config import RetrievalConfig
+from database import Database
+
+
+class VectorStore:
+    """
+    KNN search over the embeddings of a database
+
+    Subclasses rank ids (get_query_ids); get_query then reads the texts of the
+    results from self.db in one query.
+    """
+
+    db: Database
+
+    def get_query_ids(self, query_embedding, k: int = 5, oversample: int = 8):
+        """Return (document_id, distance) pairs, best first"""
+        raise NotImplementedError
+
+    def get_query_ids_batch(self, query_embeddings, k: int = 5, oversample: int = 8):
+        """Return the pairs of each query (see get_query_ids)"""
+        return [self.get_query_ids(query_embedding, k=k, oversample=oversample) for query_embedding in query_embeddings]
+
+    def get_query(self, query_embedding, k: int = 5, oversample: int = 8):
+        """Return rows of (contents, distance, document_id), best first"""
+        return self.db.with_contents(self.get_query_ids(query_embedding, k=k, oversample=oversample))
+
+    def get_query_batch(self, query_embeddings, k: int = 5, oversample: int = 8):
+        """Return the rows of each query (see get_query)"""
+        rankings = self.get_query_ids_batch(query_embeddings, k=k, oversample=oversample)
+        return [self.db.with_contents(ranking) for ranking in rankings]
+
+
+class SqliteVecStore(VectorStore):
+    """Search the sqlite-vec table of the database"""
+
+    def __init__(self, db: Database):
+        self.db = db
+
+    def get_query_ids(self, query_embedding, k: int = 5, oversample: int = 8):
+        return self.db.get_query_ids(query_embedding, k=k, oversample=oversample)
+
+
+class _Snapshot(NamedTuple):
+    """State of a NumpyVectorStore, replaced as a whole so searches never see half of an update"""
+    matrix: np.ndarray # memory-mapped rows of the matrix files
+    extra: np.ndarray # rows inserted since the files were written
+    ids: np.ndarray # document ids of the matrix rows, then of the extra rows
+    norms: np.ndarray # squared norms of the same rows
+    max_id: int
+    data_version: int
+    delete_version: int
+
+
+class NumpyVectorStore(VectorStore):
+    """Exact search over a memory-mapped float32 matrix of the database's vectors"""
+
+    # Rewrite the matrix files once the rows added in memory exceed this share of the mapped rows
+    REBUILD_RATIO = 0.25
+
+    def __init__(self, db: Database, path: Optional[str] = None):
+        """
+        Args:
+            db: Database the vectors are copied from and the contents read from
+            path: Prefix of the matrix files (default: next to the database file)
+        """
+        self.db = db
+        self.path = path or db.path + ".vectors"
+        self._lock = threading.Lock() # one refresh at a time; searches never wait
+        self._load()
+
+    def _files(self):
+        return self.path + ".npy", self.path + ".ids.npy", self.path + ".json"
+
+    def _temp_path(self, path: str) -> str:
+        """Unique file next to path, so concurrent builds never write to the same file"""
+        fd, temp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix=os.path.basename(path) + ".",
+                                    suffix=".tmp")
+        os.close(fd)
+        return temp
+
+    def build(self):
+        """Write the vectors of the database to the matrix files (replaced atomically)"""
+        matrix_path, ids_path, meta_path = self._files()
+        # Read before the rows: a change committed while reading is picked up by the next refresh
+        meta = {"data_version": self.db.get_data_version(), "delete_version": self.db.get_delete_version()}
+        ids, vectors = [], []
+        for document_id, vector in self.db.get_embeddings():
+            ids.append(document_id)
+            vectors.append(vector)
+        meta["max_id"] = ids[-1] if ids else 0
+        temp_matrix, temp_ids, temp_meta = (self._temp_path(path) for path in (matrix_path, ids_path, meta_path))
+        if vectors:
+            matrix = np.lib.format.open_memmap(temp_matrix, mode="w+", dtype=np.float32,
+                                               shape=(len(vectors), len(vectors[0])))
+            for start in range(0, len(vectors), 10000):
+                matrix[start:start + 10000] = np.stack(vectors[start:start + 10000])
+            matrix.flush()
+            del matrix
+        else: # nothing to map
+            with open(temp_matrix, "wb") as f:
+                np.save(f, np.zeros((0, 0), dtype=np.float32))
+        with open(temp_ids, "wb") as f:
+            np.save(f, np.asarray(ids, dtype=np.int64))
+        with open(temp_meta, "w") as f:
+            json.dump(meta, f)
+        os.replace(temp_matrix, matrix_path)
+        os.replace(temp_ids, ids_path)
+        os.replace(temp_meta, meta_path)
+
+    def _read_meta(self):
+        matrix_path, _, meta_path = self._files()
+        if not os.path.exists(meta_path) or not os.path.exists(matrix_path):
+            return None
+        with open(meta_path) as f:
+            meta = json.load(f)
+        return meta if "delete_version" in meta else None # files from before appends were supported
+
+    def _load(self, rebuild: bool = False):
+        """
+        Map the matrix files, then add the rows inserted since they were written
+
+        The files are rewritten first if they are missing, rebuild is set, or
+        documents were deleted since they were written.
+        """
+        matrix_path, ids_path, _ = self._files()
+        meta = None if rebuild else self._read_meta()
+        for _ in range(2):
+            if meta is None or meta["delete_version"] != self.db.get_delete_version():
+                self.build()
+                meta = self._read_meta()
+            ids = np.load(ids_path)
+            matrix = np.load(matrix_path, mmap_mode="r" if len(ids) else None) # empty files cannot be mapped
+            if len(ids) == len(matrix): # else another process replaced the files while they were read
+                break
+            meta = None
+        self._snapshot = _Snapshot(
+            matrix=matrix,
+            extra=np.zeros((0, matrix.shape[1]), dtype=np.float32),
+            ids=ids,
+            norms=np.einsum("ij,ij->i", matrix, matrix), # squared norms, for L2 distances
+            max_id=meta["max_id"],
+            data_version=meta["data_version"],
+            delete_version=meta["delete_version"]
+        )
+        self._append()
+
+    def _append(self):
+        """Add the rows inserted after the last one loaded (inserted documents always get higher ids)"""
+        snapshot = self._snapshot
+        version = self.db.get_data_version()
+        rows = list(self.db.get_embeddings(snapshot.max_id))
+        if not rows:
+            self._snapshot = snapshot._replace(data_version=version)
+            return
+        vectors = np.stack([vector for _, vector in rows])
+        ids = np.asarray([document_id for document_id, _ in rows], dtype=np.int64)
+        self._snapshot = snapshot._replace(
+            extra=np.concatenate([snapshot.extra, vectors]) if len(snapshot.extra) else vectors,
+            ids=np.concatenate([snapshot.ids, ids]),
+            norms=np.concatenate([snapshot.norms, np.einsum("ij,ij->i", vectors, vectors)]),
+            max_id=int(ids[-1]),
+            data_version=version
+        )
+
+    def _refresh(self):
+        if self.db.get_data_version() != self._snapshot.data_version:
+            with self._lock:
+                if self.db.get_data_version() != self._snapshot.data_version:
+                    if self.db.get_delete_version() != self._snapshot.delete_version:
+                        self._load()
+                        return
+                    self._append()
+                    snapshot = self._snapshot
+                    if len(snapshot.extra) > max(len(snapshot.matrix) * self.REBUILD_RATIO, 1000):
+                        self._load(rebuild=True)
+
+    def get_query_ids(self, query_embedding, k: int = 5, oversample: int = 8):
+        return self.get_query_ids_batch([query_embedding], k=k)[0]
+
+    def get_query_ids_batch(self, query_embeddings, k: int = 5, oversample: int = 8):
+        """Search all queries with one matrix product (oversample is unused: the search is exact)"""
+        self._refresh()
+        matrix, extra, ids, norms = self._snapshot[:4] # one consistent state, however the store is refreshed meanwhile
+        if len(ids) == 0:
+            return [[] for _ in query_embeddings]
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        products = queries @ matrix.T if len(matrix) else np.zeros((len(queries), 0), dtype=np.float32)
+        if len(extra):
+            products = np.hstack([products, queries @ extra.T])
+        # ||x - q||^2 = ||x||^2 - 2 x.q + ||q||^2
+        distances = norms[None, :] - 2 * products + np.einsum("ij,ij->i", queries, queries)[:, None]
+        k = min(k, len(ids))
+        top = np.argpartition(distances, k - 1, axis=1)[:, :k]
+        results = []
+        for row, candidates in enumerate(top):
+            candidates = candidates[np.argsort(distances[row, candidates])]
+            results.append([
+                (int(ids[i]), float(np.sqrt(max(distances[row, i], 0.0))))
+                for i in candidates
+            ])
+        return results
+
+
+STORES = ["sqlite", "numpy"]
+
+
+def get_vector_store(db: Database, store: Optional[str] = None) -> VectorStore:
+    """
+    Open the vector store of a database
+
+    Args:
+        db: Database to search
+        store: "sqlite" or "numpy" (default from RetrievalConfig)
+    """
+    store = store or RetrievalConfig.get_retrieval_info()["vector_store"]
+    if store == "sqlite":
+        return SqliteVecStore(db)
+    if store == "numpy":
+        return NumpyVectorStore(db)
+    raise ValueError(f"Invalid vector store: {store}. Available: {STORES}")
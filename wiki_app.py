@@ -1,10 +1,28 @@
 import gradio as gr
 from database import Database # for query database
-from llm import get_llm_output, get_llm_stream # get llm output
-from embedding import get_embedding # covert text to embedding
-from reranker import get_reranker # ranking embedding
-from config import LanguageConfig
+from vector_store import get_vector_store
+from llm import get_llm_output, get_llm_pool, get_llm_stream # get llm output
+from retrieval import get_semantic_cache, rerank, retrieve # search the database and rank the results
+from prompt import build_rag_prompt # fit history and documents into the token budget
+from config import LanguageConfig, RetrievalConfig, ServingConfig
+import models
+from pipeline import RAGPipeline
+from streaming import coalesce, gradio_stream_async, mount_sse_api
 db=Database("wiki.db") # wiki.db
+store=get_vector_store(db) # VECTOR_STORE: sqlite-vec table or memory-mapped NumPy matrix
+semantic_cache=get_semantic_cache("wiki_answers.db") # None unless SEMANTIC_CACHE=1
+# Async pipeline: embed, retrieve and rerank of one request overlap with the generation of others
+pipeline=RAGPipeline(db, store, semantic_cache, status={
+    "retrieve": "検索中...",
+    "rerank": "関連文書をランキング中...",
+    "generate": "回答を生成中..."
+})
+
+
+def _coalescing():
+    """Delta coalescing settings (STREAM_INTERVAL_MS, STREAM_MAX_BYTES)"""
+    info = ServingConfig.get_serving_info()
+    return {"interval_ms": info["stream_interval_ms"], "max_bytes": info["stream_max_bytes"]}
 
 
 def search(query, history, k=5, stream=True):
@@ -18,18 +36,15 @@ def search(query, history, k=5, stream=True):
         stream: If True, yields streaming response; if False, returns complete response
     
     Returns/Yields:
-        If stream=True: Generator yielding response chunks
+        If stream=True: Generator yielding response deltas (new text only), the references last
         If stream=False: Complete response string
     """
-    # Get embedding for query (is_query=True for sentence-transformers)
-    if hasattr(get_embedding, '__code__') and 'is_query' in get_embedding.__code__.co_varnames:
-        query_embedding = get_embedding(query, is_query=True)["data"][0]['embedding']
-    else:
-        query_embedding = get_embedding(query)["data"][0]['embedding']
-    results_query = db.get_query(query_embedding, k=k)
+    results_query = retrieve(db, query, k=k, store=store)
     list_txt = [i[0] for i in results_query]
-    list_txt_rank = get_reranker(query, list_txt) # [float, ...] that match list_txt
-    list_txt = [i for i, j in zip(list_txt, list_txt_rank) if j >= 0]
+    list_txt_rank = rerank(query, results_query) # [float, ...] that match list_txt
+    # Relevant documents, best first, so the prompt packer drops the lowest-ranked ones
+    ranked = sorted(zip(list_txt, list_txt_rank), key=lambda x: x[1], reverse=True)
+    list_txt = [i for i, j in ranked if j >= 0]
     
     if len(list_txt) == 0:
         error_msg = LanguageConfig.get_message("no_results_error")
@@ -39,28 +54,22 @@ def search(query, history, k=5, stream=True):
         else:
             return error_msg
     
-    str_txt = '\n'.join(['- ' + i.strip() for i in list_txt])
-    # RAG prompt
-    temp = LanguageConfig.get_message("rag_prompt").format(query=query, documents=str_txt)
-    # Create a copy of history and add the RAG prompt
-    llm_messages = history.copy()
-    llm_messages.append({"role": "user", "content": temp})
+    # RAG prompt: history and documents packed into the token budget
+    prompt = build_rag_prompt(query, list_txt, history)
+    llm_messages = prompt["messages"]
+    str_txt = prompt["str_documents"]
     
     if stream:
-        # Stream the response
-        response_text = ""
-        for chunk in get_llm_stream(llm_messages):
-            response_text += chunk
-            yield response_text
-        # Add references at the end
-        yield response_text + "\n\nReferences:\n" + str_txt
+        # Stream the response as deltas, then the references
+        yield from coalesce(get_llm_stream(llm_messages), **_coalescing())
+        yield "\n\nReferences:\n" + str_txt
     else:
         # Non-streaming response (backward compatibility)
         response = get_llm_output(llm_messages)["choices"][0]['message']["content"]
         return response + "\n\nReferences:\n" + str_txt
 
 
-def respond(
+async def respond(
     message,
     history: list[tuple[str, str]],
     k
@@ -74,7 +83,7 @@ def respond(
         k: Number of documents to retrieve for RAG
         
     Yields:
-        Streaming response chunks
+        The status messages, then the response so far
     """
     messages = []
 
@@ -84,49 +93,8 @@ def respond(
         if val[1]:
             messages.append({"role": "assistant", "content": val[1]})
 
-    # Show initial processing message
-    yield "検索中..."
-    
-    # Perform RAG search
-    # Get embedding for query (is_query=True for sentence-transformers)
-    if hasattr(get_embedding, '__code__') and 'is_query' in get_embedding.__code__.co_varnames:
-        query_embedding = get_embedding(message, is_query=True)["data"][0]['embedding']
-    else:
-        query_embedding = get_embedding(message)["data"][0]['embedding']
-    
-    yield "文書を検索中..."
-    results_query = db.get_query(query_embedding, k=k)
-    list_txt = [i[0] for i in results_query]
-    
-    yield "関連文書をランキング中..."
-    list_txt_rank = get_reranker(message, list_txt) # [float, ...] that match list_txt
-    list_txt = [i for i, j in zip(list_txt, list_txt_rank) if j >= 0]
-    
-    if len(list_txt) == 0:
-        yield LanguageConfig.get_message("no_results_error")
-        return
-    
-    str_txt = '\n'.join(['- ' + i.strip() for i in list_txt])
-    # RAG prompt
-    temp = LanguageConfig.get_message("rag_prompt").format(query=message, documents=str_txt)
-    # Create a copy of history and add the RAG prompt
-    llm_messages = messages.copy()
-    llm_messages.append({"role": "user", "content": temp})
-    
-    yield "回答を生成中..."
-    
-    # Stream the actual LLM response
-    response_text = ""
-    first_chunk = True
-    for chunk in get_llm_stream(llm_messages):
-        response_text += chunk
-        # After the first chunk arrives, start showing the actual response
-        if first_chunk:
-            first_chunk = False
-        yield response_text
-    
-    # Add references at the end
-    yield response_text + "\n\nReferences:\n" + str_txt
+    async for text in gradio_stream_async(pipeline.answer(message, messages, k)):
+        yield text
 
 
 demo = gr.ChatInterface(
@@ -138,4 +106,16 @@ demo = gr.ChatInterface(
 
 
 if __name__ == "__main__":
-    demo.launch()
+    # Load models now instead of on the first request (the embedder is not needed for lexical retrieval)
+    names = ["reranker"] if RetrievalConfig.get_retrieval_info()["mode"] == "lexical" else ["embedding", "reranker"]
+    if get_llm_pool() is None: # with LLM_WORKERS, the workers have loaded their own models
+        names.append("llm")
+    models.warmup(names)
+    info = ServingConfig.get_serving_info()
+    demo.queue(default_concurrency_limit=info["concurrency"])
+    if info["sse_api"]:
+        # Gradio UI at / and Server-Sent Events at /api/answer?q=...&k=5
+        import uvicorn
+        uvicorn.run(mount_sse_api(demo, pipeline.answer), host=info["host"], port=info["port"])
+    else:
+        demo.launch()
@@ -1,19 +1,26 @@
-from datasets import load_dataset
+import time
 from database import Database
-from embedding import get_embedding, get_embedding_dimension
-from tqdm.auto import tqdm
+from embedding import get_embedding_dimension
+from config import IngestConfig
+from ingest import dataset_texts, ingest
 
-ds = load_dataset("euirim/goodwiki",split="train").select(range(500)) # first 500
 
-list_law=list(ds["markdown"]) # list of texts
+if __name__ == "__main__": # required for multi-process ingestion (INGEST_WORKERS > 1)
+    list_law=dataset_texts("euirim/goodwiki", ["markdown"], split="train", limit=500) # first 500, read as they are embedded
 
-# Create database
-db=Database("wiki.db") # thailaw.db
-# Get embedding model dimension and create database
-embedding_dim = get_embedding_dimension()
-print(f"Creating database with embedding dimension: {embedding_dim}")
-db.create_db(embedding_dim=embedding_dim)
+    # Create database
+    db=Database("wiki.db") # thailaw.db
+    # Get embedding model dimension and create database
+    embedding_dim = get_embedding_dimension()
+    print(f"Creating database with embedding dimension: {embedding_dim}")
+    ingest_info = IngestConfig.get_ingest_info()
+    db.create_db(embedding_dim=embedding_dim, quantization=ingest_info["quantization"],
+                 compression=ingest_info["compression"], prefilter_dim=ingest_info["prefilter_dim"])
 
-# insert data to database
-for text in tqdm(list_law):
-    db.insert(text, get_embedding(text)["data"][0]['embedding'])
+    # insert data to database in batches
+    start = time.perf_counter()
+    stats = ingest("wiki.db", list_law, total=500)
+    elapsed = time.perf_counter() - start
+    print(f"Inserted {stats['documents']} documents as {stats['chunks']} chunks in {elapsed:.1f}s "
+          f"({stats['documents'] / elapsed:.1f} docs/sec, {stats['chunks'] / elapsed:.1f} chunks/sec); "
+          f"skipped {stats['skipped']} already in the database or repeated")